@@ -1,114 +1,883 @@
 import json
 import os
-from web3 import Web3
+from web3 import Web3, AsyncWeb3, AsyncHTTPProvider, WebSocketProvider
+import aiohttp
 import hashlib
+import threading
+import math
+import re
+import queue
+import asyncio
+import atexit
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from time import monotonic, time, sleep
+
+from web3.exceptions import Web3RPCError, ContractLogicError
+from eth_abi import encode as abi_encode, decode as abi_decode
+from eth_account import Account
+from eth_utils import function_abi_to_4byte_selector, event_abi_to_log_topic
+from eth_utils.abi import get_abi_input_types, get_abi_output_types
+from hexbytes import HexBytes
+from web3.datastructures import AttributeDict
+from web3.providers import JSONBaseProvider
+
+import cassette
 
 web3 = None
 chain_id = 31337
+# for the async variants (interact_*_async, AsyncContract, AsyncL1Identity), see connect_async
+async_web3 = None
+
+# One JSON-RPC endpoint of a MultiEndpointProvider with moving averages (EWMA) of its latency and error rate.
+# The error rate also decays over time (halving every `recovery` seconds), so that an endpoint that failed is tried
+# again later instead of ranking last forever.
+class Endpoint():
+    def __init__(self, url: str, alpha: float = 0.2, timeout: float = 10, recovery: float = 30):
+        self.url = url
+        # no retries inside web3, failing over to the next endpoint is faster
+        self.provider = Web3.HTTPProvider(url, request_kwargs={"timeout": timeout}, exception_retry_configuration=None)
+        self.alpha = alpha
+        self.timeout = timeout
+        self.recovery = recovery
+        self.latency = None # seconds, None until the first answer
+        self.pending = 0 # requests in flight
+        self._errors = 0.0 # 0: no recent errors, 1: only errors
+        self._observed = monotonic()
+
+    @property
+    def errors(self) -> float:
+        return self._errors * 0.5 ** ((monotonic() - self._observed) / self.recovery)
+
+    def observe(self, latency: float | None, ok: bool):
+        if ok:
+            self.latency = latency if self.latency is None else self.alpha * latency + (1 - self.alpha) * self.latency
+        self._errors = self.alpha * (0.0 if ok else 1.0) + (1 - self.alpha) * self.errors
+        self._observed = monotonic()
+
+    def score(self) -> float:
+        # expected time to a good answer, lower is better. Untried endpoints (and those whose errors have been forgotten
+        # without ever answering) come first, so that they get measured, but only one request at a time. Endpoints that
+        # never answered count as taking the whole timeout
+        errors = self.errors
+        if self.latency is None and errors < 0.01 and self.pending == 0:
+            return 0.0
+        return (self.timeout if self.latency is None else self.latency) / max(1 - errors, 0.01)
+
+    def __repr__(self):
+        return f"<Endpoint {self.url} latency {self.latency} errors {round(self.errors, 3)}>"
+
+# A web3 provider on several endpoints. Reads go to the endpoint with the best score and, if it has not answered after
+# hedgeDelay (default: its average latency), to the second one as well (hedged, the first answer wins). Everything else
+# goes to the best endpoint, and on a transport error (timeout, connection, HTTP status) the request fails over to the
+# next one. Log filters live on one node, so filter requests stay on the endpoint that
+# created the filter.
+class MultiEndpointProvider(JSONBaseProvider):
+    HEDGED_METHODS = {"eth_call", "eth_blockNumber", "eth_getBlockByNumber", "eth_getBlockByHash", "eth_getTransactionCount",
+        "eth_getTransactionReceipt", "eth_getTransactionByHash", "eth_getBalance", "eth_getStorageAt", "eth_getCode", "eth_getLogs",
+        "eth_chainId", "eth_feeHistory", "eth_estimateGas", "eth_gasPrice", "eth_maxPriorityFeePerGas"}
+    FILTER_METHODS = {"eth_getFilterChanges", "eth_getFilterLogs", "eth_uninstallFilter"}
+    NEW_FILTER_METHODS = {"eth_newFilter", "eth_newBlockFilter", "eth_newPendingTransactionFilter"}
+
+    def __init__(self, urls: list[str], hedge: int = 2, hedgeDelay: float | None = None, alpha: float = 0.2, timeout: float = 10):
+        super().__init__()
+        self.endpoints = [Endpoint(url, alpha, timeout) for url in urls]
+        self.hedge = hedge
+        # seconds before asking the next endpoint, 0 asks both at once. None waits as long as the first endpoint
+        # takes on average, so that only slow answers are hedged and the losing requests do not fill up the pool
+        self.hedgeDelay = hedgeDelay
+        self._pool = ThreadPoolExecutor(max_workers=max(4, 2 * len(urls)), thread_name_prefix="rpc")
+        self._filters = {} # filter id -> endpoint
+        self._lock = threading.Lock()
+
+    def ranked(self) -> list[Endpoint]:
+        return sorted(self.endpoints, key=lambda e: e.score())
+
+    def _send(self, endpoint: Endpoint, request):
+        with self._lock:
+            endpoint.pending += 1
+        startTime = monotonic()
+        try:
+            response = request(endpoint.provider)
+        except Exception:
+            endpoint.observe(None, False)
+            raise
+        finally:
+            with self._lock:
+                endpoint.pending -= 1
+        endpoint.observe(monotonic() - startTime, True)
+        return response
+
+    def _failover(self, request, endpoints: list[Endpoint]):
+        error = None
+        for endpoint in endpoints:
+            try:
+                return self._send(endpoint, request)
+            except Exception as e:
+                error = e
+        raise error
+
+    def _hedged(self, request):
+        waiting = self.ranked()
+        first = waiting.pop(0)
+        # an endpoint without a measured latency yet is hedged right away
+        hedgeDelay = self.hedgeDelay if self.hedgeDelay is not None else (first.latency or 0)
+        pending = {self._pool.submit(self._send, first, request)}
+        hedged = 1
+        error = None
+        while pending:
+            canHedge = waiting and hedged < self.hedge
+            done, pending = wait(pending, timeout=hedgeDelay if canHedge else None, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    return future.result() # the others finish in the background and still update their averages
+                except Exception as e:
+                    error = e
+                    # a failed endpoint is replaced by the next one right away
+                    if waiting:
+                        pending.add(self._pool.submit(self._send, waiting.pop(0), request))
+            if not done and canHedge:
+                # no answer within the hedge delay, ask the next endpoint as well
+                pending.add(self._pool.submit(self._send, waiting.pop(0), request))
+                hedged += 1
+        raise error
+
+    def _pinned(self, requests) -> Endpoint | None:
+        # the endpoint that created a filter one of the requests uses
+        for method, params in requests:
+            if method in __class__.FILTER_METHODS and params and params[0] in self._filters:
+                return self._filters[params[0]]
+        return None
+
+    def _route(self, requests, request, responses):
+        # requests: the (method, params) that `request` sends, responses: the list of responses of what it returns
+        endpoint = self._pinned(requests)
+        createsFilter = any(method in __class__.NEW_FILTER_METHODS for method, _ in requests)
+        if endpoint is None and createsFilter:
+            endpoint = self.ranked()[0]
+        if endpoint is not None:
+            response = self._send(endpoint, request)
+            for (method, _), r in zip(requests, responses(response)):
+                if method in __class__.NEW_FILTER_METHODS and "result" in r:
+                    self._filters[r["result"]] = endpoint
+            return response
+        if all(method in __class__.HEDGED_METHODS for method, _ in requests):
+            return self._hedged(request)
+        return self._failover(request, self.ranked())
+
+    def make_request(self, method, params):
+        return self._route([(method, params)], lambda provider: provider.make_request(method, params), lambda response: [response])
+
+    def make_batch_request(self, requests):
+        # filters are created and polled in batches as well (EventWatcher), so batches are routed like single requests
+        return self._route(requests, lambda provider: provider.make_batch_request(requests), lambda response: response if isinstance(response, list) else [])
+
+    def is_connected(self, show_traceback: bool = False) -> bool:
+        return any(e.provider.is_connected() for e in self.endpoints)
+
+def make_provider(urls: str):
+    # a provider for a comma separated list of endpoints
+    # RPC_CASSETTE=record:<file> records the session, replay:<file> serves it back without a node (see cassette.py),
+    # RPC_CASSETTE_LATENCY scales the recorded latency when replaying (default 0, no waiting)
+    mode, _, file = os.getenv("RPC_CASSETTE", "").partition(":")
+    if mode == "replay":
+        return cassette.ReplayProvider(file, float(os.getenv("RPC_CASSETTE_LATENCY", "0")))
+    urls = [url.strip() for url in urls.split(",") if url.strip()]
+    provider = Web3.HTTPProvider(urls[0]) if len(urls) == 1 else MultiEndpointProvider(urls)
+    if mode == "record":
+        return cassette.RecordingProvider(provider, file)
+    assert mode == "", f"RPC_CASSETTE must be record:<file> or replay:<file>, not {mode}"
+    return provider
+
+# Per-process caches, so that polling loops only pay for the RPC round trip:
+# parsed ABI files, ABI hashes, contract instances and their function objects and selectors
+_abi_files = {} # file -> (mtime, abi)
+_abi_hashes = {} # id(abi) -> (abi, hash), keeps the abi alive so that its id is not reused
+_contracts = {} # (address, abi hash) -> contract
+_functions = {} # (address, abi hash, name) -> contract function
+_selectors = {} # (abi hash, name) -> selector
+_entries = {} # (abi hash, name) -> abi entry of the function
+_decoders = {} # (address, abi hash) -> EventDecoder
+_async_contracts = {} # (address, abi hash) -> async contract
+_async_functions = {} # (address, abi hash, name) -> async contract function
+_async_decoders = {} # (address, abi hash) -> EventDecoder on the async contract
 
 def load_abi(file: str):
+    mtime = os.path.getmtime(file)
+    cached = _abi_files.get(file)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
     with open(file, "r") as f:
-        return json.loads(f.read())['abi']
+        abi = json.loads(f.read())['abi']
+    _abi_files[file] = (mtime, abi)
+    return abi
+
+def abi_hash(abi) -> str:
+    cached = _abi_hashes.get(id(abi))
+    if cached is None or cached[0] is not abi:
+        cached = (abi, hashlib.sha256(json.dumps(abi, sort_keys=True).encode()).hexdigest())
+        _abi_hashes[id(abi)] = cached
+    return cached[1]
+
+def get_contract(contract_address, abi):
+    key = (contract_address, abi_hash(abi))
+    contract = _contracts.get(key)
+    if contract is None or contract.w3 is not web3:
+        # (re)create the instance if there is none yet or L1.web3 has been replaced since
+        contract = web3.eth.contract(address=contract_address, abi=abi)
+        _contracts[key] = contract
+        for k in [k for k in _functions if k[0:2] == key]:
+            del _functions[k]
+    return contract
+
+def get_async_contract(contract_address, abi):
+    key = (contract_address, abi_hash(abi))
+    contract = _async_contracts.get(key)
+    if contract is None or contract.w3 is not async_web3:
+        contract = async_web3.eth.contract(address=contract_address, abi=abi)
+        _async_contracts[key] = contract
+        for k in [k for k in _async_functions if k[0:2] == key]:
+            del _async_functions[k]
+    return contract
+
+def get_async_function(contract_address, abi, function_name: str):
+    key = (contract_address, abi_hash(abi), function_name)
+    contract = get_async_contract(contract_address, abi)
+    f = _async_functions.get(key)
+    if f is None:
+        f = contract.functions[function_name]
+        _async_functions[key] = f
+    return f
+
+def get_function(contract_address, abi, function_name: str):
+    key = (contract_address, abi_hash(abi), function_name)
+    contract = get_contract(contract_address, abi)
+    f = _functions.get(key)
+    if f is None:
+        f = contract.functions[function_name]
+        _functions[key] = f
+    return f
+
+def function_entry(abi, function_name: str) -> dict:
+    key = (abi_hash(abi), function_name)
+    entry = _entries.get(key)
+    if entry is None:
+        entry = next(e for e in abi if e.get('type') == 'function' and e['name'] == function_name)
+        _entries[key] = entry
+    return entry
+
+def function_selector(abi, function_name: str) -> bytes:
+    key = (abi_hash(abi), function_name)
+    selector = _selectors.get(key)
+    if selector is None:
+        selector = function_abi_to_4byte_selector(function_entry(abi, function_name))
+        _selectors[key] = selector
+    return selector
+
+# Decodes the logs of one contract. The events are looked up by their topic0 (the hash of the event signature), so
+# decoding a log is a dictionary lookup plus the ABI decoding of its data, independent of the number of events.
+class EventDecoder():
+    def __init__(self, contract):
+        self.address = contract.address.lower()
+        self._events = {} # topic0 -> event
+        for entry in contract.abi:
+            if entry.get('type') == 'event' and not entry.get('anonymous', False):
+                self._events[bytes(event_abi_to_log_topic(entry))] = contract.events[entry['name']]()
+
+    @staticmethod
+    def _topic0(log) -> bytes | None:
+        topics = log['topics']
+        if len(topics) == 0:
+            return None
+        # HexBytes from web3, or hex strings from raw JSON-RPC responses
+        return bytes.fromhex(topics[0][2:]) if isinstance(topics[0], str) else bytes(topics[0])
+
+    def decode(self, log):
+        # the decoded event, or None if the log was not emitted by this contract or is not one of its events
+        if log['address'].lower() != self.address:
+            return None
+        event = self._events.get(__class__._topic0(log))
+        if event is None:
+            return None
+        return event.process_log(log)
+
+    def decode_logs(self, logs: list) -> list:
+        # e.g. thousands of historic logs when indexing games, in the order of the logs
+        ret = []
+        for log in logs:
+            dec = self.decode(log)
+            if dec is not None:
+                ret.append(dec)
+        return ret
+
+def get_event_decoder(contract_address, abi) -> EventDecoder:
+    key = (contract_address, abi_hash(abi))
+    decoder = _decoders.get(key)
+    if decoder is None:
+        decoder = EventDecoder(get_contract(contract_address, abi))
+        _decoders[key] = decoder
+    return decoder
+
+def get_async_event_decoder(contract_address, abi) -> EventDecoder:
+    key = (contract_address, abi_hash(abi))
+    decoder = _async_decoders.get(key)
+    if decoder is None:
+        decoder = EventDecoder(get_async_contract(contract_address, abi))
+        _async_decoders[key] = decoder
+    return decoder
 
 def interact_call(contract_address, abi, function_name: str, args: list):
-    # Create contract instance at the deployed address
-    contract = web3.eth.contract(address=contract_address, abi=abi)
-    f = getattr(contract.functions, function_name)
+    f = get_function(contract_address, abi, function_name)
     value = f(*args).call()
 
     return value
 
 def interact_read(contract_address, abi, variable_name: str):
-    contract = web3.eth.contract(address=contract_address, abi=abi)
-    return contract.functions[variable_name].call()
+    return get_function(contract_address, abi, variable_name)().call()
 
-def interact_transact(contract_address, abi, function_name: str, args: list, address, private_key, value: int = 0, overrideGas: int|None = None):
-    # Create contract instance at the deployed address
-    contract = web3.eth.contract(address=contract_address, abi=abi)
+# JSON-RPC batching: requests are collected and sent as one batch (in chunks of at most maxSize requests). Every
+# request gets its own result; a failing request (e.g. a reverting eth_call) only fails its own result.
+def _checksum_addresses(types: list, values) -> list:
+    # eth_abi returns lower case addresses, contract calls through web3 checksummed ones
+    return [Web3.to_checksum_address(v) if t == 'address' else [Web3.to_checksum_address(a) for a in v] if t == 'address[]' else v for t, v in zip(types, values)]
+
+def _encode_call(abi, function_name: str, args: list) -> bytes:
+    return function_selector(abi, function_name) + abi_encode(get_abi_input_types(function_entry(abi, function_name)), args)
+
+def _decode_return(abi, function_name: str, data: bytes):
+    types = get_abi_output_types(function_entry(abi, function_name))
+    values = _checksum_addresses(types, abi_decode(types, data))
+    # like contract calls: the value itself for one output, a list for several
+    return values[0] if len(values) == 1 else values
+
+def _decode_call(abi, function_name: str, data: str):
+    return _decode_return(abi, function_name, bytes.fromhex(data[2:]))
+
+def _hex_to_int(value: str) -> int:
+    return int(value, 16)
+
+BLOCK_QUANTITIES = ['number', 'timestamp', 'baseFeePerGas', 'gasLimit', 'gasUsed']
+
+def _decode_block(block: dict) -> dict:
+    # the fields the fee oracle and the game loop use, the others stay hex strings
+    return {k: _hex_to_int(v) if k in BLOCK_QUANTITIES else v for k, v in block.items()}
+
+def _block_id(block) -> str:
+    return hex(block) if isinstance(block, int) else block
+
+class _Batch():
+    def __init__(self, maxSize: int = 100):
+        self.maxSize = maxSize
+        self._lock = threading.Lock()
+        self._requests = [] # (method, params, decode, result)
+
+    def _add(self, method: str, params: list, decode, result):
+        with self._lock:
+            self._requests.append((method, params, decode, result))
+        return result
+
+    def _take(self) -> list:
+        with self._lock:
+            requests, self._requests = self._requests, []
+        return requests
+
+    @staticmethod
+    def _route(requests: list, responses):
+        if not isinstance(responses, list):
+            # the node rejected the batch as a whole
+            responses = [responses] * len(requests)
+        for (method, params, decode, result), response in zip(requests, responses):
+            if result.done():
+                continue # e.g. a cancelled asyncio future
+            try:
+                if 'error' in response:
+                    raise Web3RPCError(f"{method} failed: {response['error'].get('message')}", rpc_response=response)
+                result.set_result(decode(response['result']))
+            except Exception as e:
+                result.set_exception(e)
+
+    @staticmethod
+    def _fail(requests: list, error: Exception):
+        # the batch did not make it to the node, every request fails with the same error
+        for _, _, _, result in requests:
+            if not result.done():
+                result.set_exception(error)
+
+    def call(self, contract_address, abi, function_name: str, args: list = [], block = "latest"):
+        data = _encode_call(abi, function_name, args)
+        return self.request("eth_call", [{"to": contract_address, "data": "0x" + data.hex()}, _block_id(block)], lambda r: _decode_call(abi, function_name, r))
+
+    def get_block(self, block = "latest"):
+        return self.request("eth_getBlockByNumber", [_block_id(block), False], _decode_block)
+
+    def get_transaction_count(self, address, block = "pending"):
+        return self.request("eth_getTransactionCount", [address, _block_id(block)], _hex_to_int)
+
+    def get_balance(self, address, block = "latest"):
+        return self.request("eth_getBalance", [address, _block_id(block)], _hex_to_int)
+
+    def get_storage_at(self, address, slot: int, block = "latest"):
+        return self.request("eth_getStorageAt", [address, hex(slot), _block_id(block)], lambda r: bytes.fromhex(r[2:]).rjust(32, b'\0'))
+
+class BatchResult():
+    # result of one request of an RpcBatch, asking for it sends the batch if that has not happened yet
+    def __init__(self, batch):
+        self._batch = batch
+        self._done = False
+        self._value = None
+        self._error = None
+
+    def set_result(self, value):
+        self._value = value
+        self._done = True
+
+    def set_exception(self, error: Exception):
+        self._error = error
+        self._done = True
+
+    def done(self) -> bool:
+        return self._done
+
+    def result(self):
+        if not self._done:
+            self._batch.execute()
+        if self._error is not None:
+            raise self._error
+        return self._value
 
+# Blocking batch on L1.web3: all requests added before the first result is needed (or execute() is called) are
+# sent in one round trip, e.g.
+#   batch = RpcBatch()
+#   state, timeout = batch.call(address, abi, "games", [gameId]), batch.call(address, abi, "isGameTimeout", [gameId])
+#   state.result() # sends both
+class RpcBatch(_Batch):
+    def request(self, method: str, params: list, decode = lambda r: r) -> BatchResult:
+        return self._add(method, params, decode, BatchResult(self))
+
+    def execute(self):
+        requests = self._take()
+        for i in range(0, len(requests), self.maxSize):
+            chunk = requests[i:i + self.maxSize]
+            try:
+                responses = web3.provider.make_batch_request([(method, params) for method, params, _, _ in chunk])
+            except Exception as e:
+                __class__._fail(chunk, e)
+                continue
+            __class__._route(chunk, responses)
+
+def read_storage(address, slots, block = "latest", batchSize: int = 100, parallel: int = 4) -> dict[int, bytes]:
+    # slot -> 32 byte word, in batches of `batchSize` slots of which up to `parallel` are in flight at once
+    slots = list(slots)
+    def read(chunk: list) -> list:
+        batch = RpcBatch(batchSize)
+        results = [batch.get_storage_at(address, slot, block) for slot in chunk]
+        return [r.result() for r in results]
+    with ThreadPoolExecutor(parallel) as pool:
+        values = pool.map(read, [slots[i:i + batchSize] for i in range(0, len(slots), batchSize)])
+        return dict(zip(slots, (value for chunk in values for value in chunk)))
+
+# Tip strategies for the FeeOracle: called with the oracle, return the priority fee in wei
+class FixedTip():
+    def __init__(self, tip: int):
+        self.tip = tip
+
+    def __call__(self, oracle) -> int:
+        return self.tip
+
+    async def call_async(self, oracle) -> int:
+        return self.tip
+
+class FeeHistoryTip():
+    # the given percentile of the priority fees paid in the last `blocks` blocks (eth_feeHistory), at least `minimum`
+    def __init__(self, percentile: float = 50, blocks: int = 10, minimum: int = 0):
+        self.percentile = percentile
+        self.blocks = blocks
+        self.minimum = minimum
+
+    def __call__(self, oracle) -> int:
+        history = web3.eth.fee_history(self.blocks, oracle.block, [self.percentile])
+        return self._tip(history)
+
+    async def call_async(self, oracle) -> int:
+        return self._tip(await async_web3.eth.fee_history(self.blocks, oracle.block, [self.percentile]))
+
+    def _tip(self, history) -> int:
+        rewards = sorted(r[0] for r in history["reward"])
+        return max(rewards[len(rewards) // 2] if rewards else 0, self.minimum)
+
+# Caches the base fee of the latest block and the tip. Block watchers push new headers with on_block(), otherwise
+# the cache is refreshed with eth_getBlockByNumber once it is older than `maxAge` seconds. To survive a few blocks of
+# rising base fees, maxFeePerGas is baseFeeMultiplier * base fee + tip.
+class FeeOracle():
+    def __init__(self, tipStrategy = FixedTip(Web3.to_wei(0.01, "gwei")), maxAge: float = 12, baseFeeMultiplier: int = 2):
+        self.tipStrategy = tipStrategy
+        self.maxAge = maxAge
+        self.baseFeeMultiplier = baseFeeMultiplier
+        self._lock = threading.Lock()
+        self.block = None
+        self._baseFee = None
+        self._tip = None
+        self._updated = 0
+
+    def on_block(self, header):
+        # header of a new block, e.g. from a newHeads subscription or get_block("latest"), EventWatcher and
+        # ConfirmationTracker push every block they see
+        if header.get("baseFeePerGas") is None:
+            return # not an EIP-1559 block
+        with self._lock:
+            if self.block is not None and header["number"] < self.block:
+                return
+            if header["number"] != self.block:
+                self._tip = None # recompute for the new block
+            self.block = header["number"]
+            self._baseFee = header["baseFeePerGas"]
+            self._updated = monotonic()
+
+    def refresh(self):
+        self.on_block(web3.eth.get_block("latest"))
+
+    def fees(self) -> tuple[int, int]:
+        # (maxFeePerGas, maxPriorityFeePerGas)
+        if self._baseFee is None or monotonic() - self._updated > self.maxAge:
+            self.refresh()
+        with self._lock:
+            baseFee = self._baseFee
+            tip = self._tip
+        if tip is None:
+            tip = self.tipStrategy(self)
+            with self._lock:
+                self._tip = tip
+        return baseFee * self.baseFeeMultiplier + tip, tip
+
+    async def fees_async(self) -> tuple[int, int]:
+        if self._baseFee is None or monotonic() - self._updated > self.maxAge:
+            self.on_block(await async_web3.eth.get_block("latest"))
+        with self._lock:
+            baseFee = self._baseFee
+            tip = self._tip
+        if tip is None:
+            tip = await self.tipStrategy.call_async(self)
+            with self._lock:
+                self._tip = tip
+        return baseFee * self.baseFeeMultiplier + tip, tip
+
+# shared by all senders, replace it to change the tip strategy
+fee_oracle = FeeOracle()
+
+# Structured gas and latency log with one JSON object per transaction and line. Records are written by a background
+# thread, so sending transactions never waits for the disk. See gasreport.py for aggregating them.
+class GasLog():
+    def __init__(self, file: str = "gaslog.jsonl"):
+        self.file = file
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def record(self, entry: dict):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="gaslog", daemon=True)
+                self._thread.start()
+        self._queue.put(entry)
+
+    def _run(self):
+        with open(self.file, 'a') as f:
+            while True:
+                entries = [self._queue.get()]
+                # write everything that queued up in one go
+                while not self._queue.empty():
+                    entries.append(self._queue.get_nowait())
+                f.write(''.join(json.dumps(e, default=str) + '\n' for e in entries if e is not None))
+                f.flush()
+                for _ in entries:
+                    self._queue.task_done()
+                if None in entries:
+                    return
+
+    def flush(self):
+        # wait until everything recorded so far is written
+        if self._thread is not None:
+            self._queue.join()
+
+    def close(self):
+        with self._lock:
+            if self._thread is not None:
+                self._queue.put(None)
+                self._thread.join()
+                self._thread = None
+
+    @staticmethod
+    def read(file: str):
+        with open(file, 'r') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+gas_log = GasLog()
+atexit.register(lambda: gas_log.close())
+
+# Gas limits per contract function and proof scheme. The cost of a call depends on the state (e.g. the first move of a
+# game writes a fresh storage slot and costs more than later moves), so the limit is the eth_estimateGas of the node,
+# but at least the highest gas usage of a successful call seen so far (from receipts, including those in the gas logs
+# of earlier runs), plus a safety margin.
+class GasModel():
+    GASLOG_LINE = re.compile(r"Calling (\w+) on (0x[0-9a-fA-F]{40}) with args .* took (\d+) gas")
+
+    def __init__(self, margin: float = 1.25, scheme: str = "gm17", gaslogs: list[str] = ["gaslog.jsonl", "gaslog.txt"]):
+        self.margin = margin
+        self.scheme = scheme # the proof scheme changes the cost of the verifier
+        self.gaslogs = gaslogs
+        self._lock = threading.Lock()
+        self._used = None # (contract address, function name, scheme) -> highest gas used
+
+    def _load(self):
+        # learn from the gas logs of earlier runs, structured (.jsonl) or free text lines written by earlier versions
+        self._used = {}
+        for gaslog in self.gaslogs:
+            if not os.path.exists(gaslog):
+                continue
+            if gaslog.endswith('.jsonl'):
+                for e in GasLog.read(gaslog):
+                    if e.get('status') == 1:
+                        self._observe((e['contract'], e['function'], e.get('scheme', self.scheme)), e['gasUsed'])
+                continue
+            with open(gaslog, 'r') as f:
+                for line in f:
+                    m = __class__.GASLOG_LINE.match(line)
+                    if m is not None:
+                        self._observe((m.group(2), m.group(1), self.scheme), int(m.group(3)))
+
+    def _observe(self, key, gasUsed: int):
+        self._used[key] = max(self._used.get(key, 0), gasUsed)
+
+    def observe(self, contract_address, function_name: str, gasUsed: int):
+        with self._lock:
+            if self._used is None:
+                self._load()
+            self._observe((contract_address, function_name, self.scheme), gasUsed)
+
+    def _highest(self, contract_address, function_name: str) -> int | None:
+        with self._lock:
+            if self._used is None:
+                self._load()
+            return self._used.get((contract_address, function_name, self.scheme))
+
+    def limit(self, contract_address, function_name: str, estimate) -> int:
+        # `estimate` returns the gas estimate of the node
+        used = self._highest(contract_address, function_name) or 0
+        return math.ceil(max(used, estimate()) * self.margin)
+
+    async def limit_async(self, contract_address, function_name: str, estimate) -> int:
+        # same as limit, `estimate` returns an awaitable
+        used = self._highest(contract_address, function_name) or 0
+        return math.ceil(max(used, await estimate()) * self.margin)
+
+gas_model = GasModel()
+
+# Assigns nonces for one account locally, so that several transactions can be in flight at once.
+# The next nonce is read from the chain (including pending transactions) on first use and after resync().
+class NonceManager():
+    def __init__(self, address):
+        self.address = address
+        self._lock = threading.Lock()
+        self._next = None
+
+    def next_nonce(self) -> int:
+        with self._lock:
+            if self._next is None:
+                self._next = web3.eth.get_transaction_count(self.address, "pending")
+            nonce = self._next
+            self._next += 1
+            return nonce
+
+    async def next_nonce_async(self) -> int:
+        # shares the counter with next_nonce, so sync and async senders of one account do not collide
+        while True:
+            with self._lock:
+                if self._next is not None:
+                    nonce = self._next
+                    self._next += 1
+                    return nonce
+            count = await async_web3.eth.get_transaction_count(self.address, "pending")
+            with self._lock:
+                if self._next is None:
+                    self._next = count
+
+    def failed(self, nonce: int):
+        # the transaction with this nonce was not broadcast
+        with self._lock:
+            if self._next == nonce + 1:
+                self._next = nonce # nothing has been assigned since, reuse it
+            else:
+                self._next = None # there is a gap now, ask the chain again
+
+    def resync(self):
+        # e.g. after "nonce too low" or a transaction sent with this account elsewhere
+        with self._lock:
+            self._next = None
+
+    def rejected(self, nonce: int, error: Exception, fresh: bool = True):
+        # the node did not accept the transaction with this nonce. `fresh` if the nonce came from next_nonce,
+        # a nonce passed in to replace a pending transaction is never given back
+        if _is_nonce_error(error):
+            self.resync() # the nonce is used (e.g. by another sender of this account) or the counter is off
+        elif fresh:
+            self.failed(nonce)
+
+NONCE_ERRORS = ["nonce too low", "nonce too high", "already known", "known transaction", "replacement transaction underpriced"]
+
+def _is_nonce_error(error: Exception) -> bool:
+    message = str(error).lower()
+    return any(e in message for e in NONCE_ERRORS)
+
+_nonce_managers = {} # address -> NonceManager
+_nonce_managers_lock = threading.Lock()
+
+def get_nonce_manager(address) -> NonceManager:
+    with _nonce_managers_lock:
+        if address not in _nonce_managers:
+            _nonce_managers[address] = NonceManager(address)
+        return _nonce_managers[address]
+
+def _send_signed(tx: dict, private_key, nonces: NonceManager, fresh: bool = True):
+    # sign and broadcast, reconciling the nonces with the chain if the node rejects the transaction
+    signed_tx = web3.eth.account.sign_transaction(tx, private_key=private_key)
+    try:
+        return web3.eth.send_raw_transaction(signed_tx.raw_transaction)
+    except Exception as e:
+        nonces.rejected(tx["nonce"], e, fresh)
+        raise
+
+_submitted = {} # tx hash -> (function name, gas limit, submit time, latest block at submit time), for the gas log
+SUBMITTED_MAX_AGE = 3600 # seconds, entries of transactions that nobody waits for are dropped after this
+
+def _track_submitted(tx_hash, entry: tuple):
+    now = monotonic()
+    for h, (_, _, submitTime, _) in list(_submitted.items()):
+        if now - submitTime > SUBMITTED_MAX_AGE:
+            _submitted.pop(h, None)
+    _submitted[tx_hash] = entry
+
+def _wait_for_receipt(tx_hash):
+    try:
+        return web3.eth.wait_for_transaction_receipt(tx_hash)
+    except Exception:
+        _submitted.pop(tx_hash, None) # e.g. timed out, the receipt will not be logged
+        raise
+
+async def _wait_for_receipt_async(tx_hash):
+    try:
+        return await async_web3.eth.wait_for_transaction_receipt(tx_hash)
+    except Exception:
+        _submitted.pop(tx_hash, None)
+        raise
+
+def _log_receipt(contract_address, function_name: str, tx_hash, tx_receipt):
+    function_name, gasLimit, submitTime, submitBlock = _submitted.pop(tx_hash, (function_name, None, None, None))
+    gas_log.record({
+        'time': time(),
+        'contract': contract_address,
+        'function': function_name,
+        'scheme': gas_model.scheme,
+        'txHash': tx_hash.hex() if isinstance(tx_hash, bytes) else tx_hash,
+        'status': tx_receipt.status,
+        'gasUsed': tx_receipt.gasUsed,
+        'gasLimit': gasLimit,
+        'effectiveGasPrice': tx_receipt.get('effectiveGasPrice'),
+        'block': tx_receipt.blockNumber,
+        'blockDelay': None if submitBlock is None else tx_receipt.blockNumber - submitBlock,
+        'latency': None if submitTime is None else monotonic() - submitTime,
+    })
+
+# Broadcast a contract call without waiting for it to be mined, returns the transaction hash.
+# Pass `nonce` to replace a pending transaction.
+def submit_transact(contract_address, abi, function_name: str, args: list, address, private_key, value: int = 0, overrideGas: int|None = None, nonce: int|None = None):
+    return _submit_transact(contract_address, abi, function_name, args, address, private_key, value, overrideGas, nonce)[0]
+
+def _submit_transact(contract_address, abi, function_name: str, args: list, address, private_key, value: int = 0, overrideGas: int|None = None, nonce: int|None = None):
+    # returns the transaction hash and the transaction
+    f = get_function(contract_address, abi, function_name)
     if overrideGas is None:
-        overrideGas = 10000000
+        overrideGas = gas_model.limit(contract_address, function_name, lambda: f(*args).estimate_gas({"from": address, "value": value}))
 
-    base_fee = web3.eth.get_block("latest")["baseFeePerGas"]
-    priority_fee = Web3.to_wei(0.01, "gwei")  # your desired tip
-    max_fee_per_gas = base_fee + priority_fee * 2
+    max_fee_per_gas, priority_fee = fee_oracle.fees()
     
+    nonces = get_nonce_manager(address)
     txPreset = {
         "chainId": chain_id,
         "from": address,
         "value": value,  # Amount of ETH you want to send
-        "nonce": web3.eth.get_transaction_count(address),
-        # You can optionally set the gas limit and gas price, or leave it to be auto-calculated
-        "gas": 1000000,  
+        "nonce": nonces.next_nonce() if nonce is None else nonce,
+        "gas": overrideGas,
         "maxFeePerGas": max_fee_per_gas,
         "maxPriorityFeePerGas": priority_fee,
         "type": 2,
     }
     print(f"Sending value {value}")
 
-    tx = contract.functions[function_name](*args).build_transaction(txPreset)
-
-    # Sign the transaction
-    signed_tx = web3.eth.account.sign_transaction(tx, private_key=private_key)
+    try:
+        tx = f(*args).build_transaction(txPreset)
+    except Exception:
+        if nonce is None:
+            nonces.failed(txPreset["nonce"])
+        raise
 
-    # Send the transaction
-    tx_hash = web3.eth.send_raw_transaction(signed_tx.raw_transaction)
+    # Sign and send the transaction
+    tx_hash = _send_signed(tx, private_key, nonces, nonce is None)
+    _track_submitted(tx_hash, (function_name, tx["gas"], monotonic(), fee_oracle.block))
+    return tx_hash, tx
 
+def wait_transact(contract_address, abi, function_name: str, args: list, tx_hash):
     # Wait for the transaction receipt
-    tx_receipt = web3.eth.wait_for_transaction_receipt(tx_hash)
+    tx_receipt = _wait_for_receipt(tx_hash)
+    return _finish_transact(contract_address, abi, function_name, tx_hash, tx_receipt)
 
-    decoded_events = []
-    try:
-        for event in contract.events:
-            for log in tx_receipt.logs:
-                try:
-                    dec = event().process_log(log)
-                    print(f"EMITTED: {dec['event']}: {dec['args']}")
-                    decoded_events.append(dec)
-                except:
-                    pass
-    except:
-        print("Failed to decode events, maybe there are none?")
-
-    # log the gas usage of this call
-    log = f"Calling {function_name} on {contract_address} with args {args} took {tx_receipt.gasUsed} gas\n"
-    with open('gaslog.txt', 'a') as f:
-        f.write(log)
+def _finish_transact(contract_address, abi, function_name: str, tx_hash, tx_receipt):
+    decoded_events = get_event_decoder(contract_address, abi).decode_logs(tx_receipt.logs)
+    for dec in decoded_events:
+        print(f"EMITTED: {dec['event']}: {dec['args']}")
+
+    # log the gas usage of this call, failed calls may have stopped early
+    if tx_receipt.status == 1:
+        gas_model.observe(contract_address, function_name, tx_receipt.gasUsed)
+    _log_receipt(contract_address, function_name, tx_hash, tx_receipt)
 
     if tx_receipt.status == 0:
         print("TX FAILED")
         assert False
     return tx_receipt, decoded_events
 
+def interact_transact(contract_address, abi, function_name: str, args: list, address, private_key, value: int = 0, overrideGas: int|None = None):
+    tx_hash = submit_transact(contract_address, abi, function_name, args, address, private_key, value, overrideGas)
+    return wait_transact(contract_address, abi, function_name, args, tx_hash)
+
 def interact_send(contract_address, value: int, address, private_key):
     # Prepare the transaction
+    max_fee_per_gas, priority_fee = fee_oracle.fees()
+    gas = gas_model.limit(contract_address, "send", lambda: web3.eth.estimate_gas({"to": contract_address, "from": address, "value": value}))
     
-    base_fee = web3.eth.get_block("latest")["baseFeePerGas"]
-    priority_fee = Web3.to_wei(1, "gwei")  # your desired tip
-    max_fee_per_gas = base_fee + priority_fee * 2
-    
+    nonces = get_nonce_manager(address)
     tx = {
         "chainId": chain_id,
         "to": contract_address,
         "from": address,
         "value": value,  # Amount of ETH you want to send
-        "nonce": web3.eth.get_transaction_count(address),
-        # You can optionally set the gas limit and gas price, or leave it to be auto-calculated
-        "gas": 1000000,  
+        "nonce": nonces.next_nonce(),
+        "gas": gas,
         "maxFeePerGas": max_fee_per_gas,
         "maxPriorityFeePerGas": priority_fee,
         "type": 2,
     }
     print(f"SENDING {value} WEI")
 
-    # Sign the transaction
-    signed_tx = web3.eth.account.sign_transaction(tx, private_key=private_key)
-
-    # Send the transaction
-    tx_hash = web3.eth.send_raw_transaction(signed_tx.raw_transaction)
+    # Sign and send the transaction
+    tx_hash = _send_signed(tx, private_key, nonces)
+    _track_submitted(tx_hash, ("send", tx["gas"], monotonic(), fee_oracle.block))
 
     # Wait for the transaction receipt
-    tx_receipt = web3.eth.wait_for_transaction_receipt(tx_hash)
+    tx_receipt = _wait_for_receipt(tx_hash)
+    if tx_receipt.status == 1:
+        gas_model.observe(contract_address, "send", tx_receipt.gasUsed)
+    _log_receipt(contract_address, "send", tx_hash, tx_receipt)
 
     print(f"Num of logs emitted are {tx_receipt.logs}")
 
@@ -118,6 +887,441 @@ def interact_send(contract_address, value: int, address, private_key):
 
     return tx_receipt
 
+RECEIPT_QUANTITIES = ['blockNumber', 'status', 'gasUsed', 'cumulativeGasUsed', 'effectiveGasPrice', 'transactionIndex', 'type']
+
+def _format_receipt(receipt: dict) -> AttributeDict:
+    # a receipt from a raw JSON-RPC response in the form web3 returns it
+    receipt = {k: _hex_to_int(v) if k in RECEIPT_QUANTITIES else v for k, v in receipt.items()}
+    receipt['transactionHash'] = HexBytes(receipt['transactionHash'])
+    receipt['logs'] = [AttributeDict(_format_log(log)) for log in receipt['logs']]
+    return AttributeDict(receipt)
+
+class _PendingTransaction():
+    def __init__(self, tx_hash, tx: dict | None, private_key, block: int | None):
+        self.hashes = [HexBytes(tx_hash)] # the original and its replacements, any of them may be mined
+        self.tx = tx
+        self.private_key = private_key
+        self.sentBlock = block
+        self.future = Future()
+        self.nonceUsed = 0 # consecutive checks in which the nonce was used but none of our hashes had a receipt
+
+# Waits for transactions without a thread per transaction: one thread polls the latest block (and hands it to the fee
+# oracle) and, once per new block, asks for the receipts of all pending transactions in one JSON-RPC batch. The future of a transaction resolves with
+# its receipt once that has `confirmations` confirmations (1: mined). Transactions that are still pending after
+# `stuckBlocks` blocks are replaced with the same nonce and fees raised by `bump` (nodes want at least 10% more), at
+# most `maxReplacements` times.
+class ConfirmationTracker():
+    def __init__(self, confirmations: int = 1, pollInterval: float = 2, stuckBlocks: int | None = 10, bump: float = 1.125, maxReplacements: int = 5):
+        self.confirmations = confirmations
+        self.pollInterval = pollInterval
+        self.stuckBlocks = stuckBlocks
+        self.bump = bump
+        self.maxReplacements = maxReplacements
+        self._lock = threading.Lock()
+        self._pending = {} # original tx hash -> _PendingTransaction
+        self._thread = None
+        self.block = None
+
+    def track(self, tx_hash, tx: dict | None = None, private_key = None) -> Future:
+        # the future of the receipt, pass the transaction and its key to allow speeding it up
+        p = _PendingTransaction(tx_hash, tx, private_key, fee_oracle.block)
+        with self._lock:
+            self._pending[p.hashes[0]] = p
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="confirmations", daemon=True)
+                self._thread.start()
+        return p.future
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._pending:
+                    self._thread = None # started again by the next track
+                    return
+            try:
+                header = web3.eth.get_block("latest")
+                fee_oracle.on_block(header)
+                if header["number"] != self.block:
+                    self.block = header["number"]
+                    self._check(self.block)
+            except Exception as e:
+                print(f"Checking pending transactions failed: {e}")
+            sleep(self.pollInterval)
+
+    def _check(self, block: int):
+        with self._lock:
+            pending = list(self._pending.values())
+        batch = RpcBatch()
+        receipts = [(p, [batch.request("eth_getTransactionReceipt", [h.to_0x_hex()]) for h in p.hashes]) for p in pending]
+        nonces = {p.tx["from"]: batch.get_transaction_count(p.tx["from"], "latest") for p in pending if p.tx is not None}
+
+        for p, results in receipts:
+            # one broken entry must not keep the others from being resolved
+            try:
+                self._check_one(p, results, nonces, block)
+            except Exception as e:
+                print(f"Checking {p.hashes[0].to_0x_hex()} failed: {e}")
+
+    def _check_one(self, p: _PendingTransaction, results: list, nonces: dict, block: int):
+        # failed lookups are simply repeated with the next block
+        found = [r for r in map(_result_or_none, results) if r is not None]
+        receipt = _format_receipt(found[0]) if found else None
+        nonce = None if p.tx is None else _result_or_none(nonces[p.tx["from"]])
+        # the nonce has been used, but not by a transaction we know (twice in a row, the receipt might just be late)
+        p.nonceUsed = p.nonceUsed + 1 if receipt is None and nonce is not None and nonce > p.tx["nonce"] else 0
+        stuck = self.stuckBlocks is not None and p.sentBlock is not None and block - p.sentBlock >= self.stuckBlocks
+        # only transactions tracked with the transaction and its key can be replaced
+        replaceable = p.tx is not None and p.private_key is not None and len(p.hashes) <= self.maxReplacements
+        if receipt is not None and block - receipt.blockNumber + 1 >= self.confirmations:
+            self._resolve(p, receipt)
+        elif p.nonceUsed > 0:
+            if p.nonceUsed >= 2:
+                self._resolve(p, None, Exception(f"Transaction {p.hashes[0].to_0x_hex()} was replaced by another transaction with nonce {p.tx['nonce']}"))
+        elif receipt is None and stuck and replaceable:
+            self.speed_up(p.hashes[0])
+
+    def _resolve(self, p: _PendingTransaction, receipt, error: Exception | None = None):
+        with self._lock:
+            self._pending.pop(p.hashes[0], None)
+        for h in p.hashes:
+            if receipt is None or h != receipt.transactionHash:
+                _submitted.pop(h, None) # replaced, never mined
+        if error is not None:
+            p.future.set_exception(error)
+        else:
+            p.future.set_result(receipt)
+
+    def speed_up(self, tx_hash):
+        # replace a pending transaction by the same one with higher fees, returns the new hash
+        with self._lock:
+            p = self._pending.get(HexBytes(tx_hash))
+        assert p is not None and p.tx is not None and p.private_key is not None, "Can only speed up tracked transactions with a known transaction and key"
+        maxFee, tip = fee_oracle.fees()
+        tx = dict(p.tx)
+        tx["maxPriorityFeePerGas"] = max(math.ceil(tx["maxPriorityFeePerGas"] * self.bump), tip)
+        tx["maxFeePerGas"] = max(math.ceil(tx["maxFeePerGas"] * self.bump), maxFee, tx["maxPriorityFeePerGas"])
+        signed_tx = web3.eth.account.sign_transaction(tx, private_key=p.private_key)
+        try:
+            new_hash = HexBytes(web3.eth.send_raw_transaction(signed_tx.raw_transaction))
+        except Exception as e:
+            # e.g. "nonce too low" if the transaction has been mined in the meantime
+            print(f"Speeding up {p.hashes[0].to_0x_hex()} failed: {e}")
+            return None
+        print(f"Replaced {p.hashes[-1].to_0x_hex()} by {new_hash.to_0x_hex()} with a priority fee of {tx['maxPriorityFeePerGas']}")
+        entry = _submitted.get(p.hashes[0])
+        if entry is not None:
+            _track_submitted(new_hash, entry) # log the latency from the first submission
+        p.hashes.append(new_hash)
+        p.tx = tx
+        p.sentBlock = self.block
+        return new_hash
+
+def _result_or_none(result: BatchResult):
+    try:
+        return result.result()
+    except Exception:
+        return None
+
+# shared by all senders
+confirmation_tracker = ConfirmationTracker()
+
+# Broadcast a contract call and return a future of (receipt, decoded events) as wait_transact returns them, without
+# blocking the caller or a thread on the receipt
+def submit_tracked(contract_address, abi, function_name: str, args: list, address, private_key, value: int = 0, overrideGas: int|None = None, tracker: ConfirmationTracker | None = None) -> Future:
+    tracker = confirmation_tracker if tracker is None else tracker
+    tx_hash, tx = _submit_transact(contract_address, abi, function_name, args, address, private_key, value, overrideGas)
+    result = Future()
+    def finish(receipt: Future):
+        try:
+            tx_receipt = receipt.result()
+            result.set_result(_finish_transact(contract_address, abi, function_name, tx_receipt.transactionHash, tx_receipt))
+        except BaseException as e:
+            result.set_exception(e)
+    tracker.track(tx_hash, tx, private_key).add_done_callback(finish)
+    return result
+
+# Async variants of the functions above on L1.async_web3, so that many reads and transactions overlap on one event
+# loop, e.g. polling hundreds of games with asyncio.gather. They share the caches, nonces, fees and gas log with the
+# blocking functions.
+def connect(urls: str, chainId: int):
+    # connect L1.web3 to a comma separated list of endpoints, see make_provider
+    global web3, chain_id
+    web3 = Web3(make_provider(urls))
+    chain_id = chainId
+    return web3
+
+async def connect_async(url: str, connections: int = 100):
+    # ws:// and wss:// urls use one WebSocket, http(s) urls one pooled session with up to `connections` keep-alive connections
+    global async_web3, _async_batcher
+    _async_batcher = None
+    if url.startswith(("ws://", "wss://")):
+        async_web3 = await AsyncWeb3(WebSocketProvider(url))
+    else:
+        provider = AsyncHTTPProvider(url)
+        await provider.cache_async_session(aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=connections, keepalive_timeout=60)))
+        async_web3 = AsyncWeb3(provider)
+    return async_web3
+
+async def disconnect_async():
+    global async_web3
+    if async_web3 is not None:
+        await async_web3.provider.disconnect()
+        async_web3 = None
+
+LOG_QUANTITIES = ['blockNumber', 'logIndex', 'transactionIndex']
+
+def _format_log(log: dict) -> dict:
+    # a log from a raw JSON-RPC response in the form web3 returns it, so that the event decoder can process it
+    log = {k: _hex_to_int(v) if k in LOG_QUANTITIES else v for k, v in log.items()}
+    log['topics'] = [HexBytes(t) for t in log['topics']]
+    log['data'] = HexBytes(log['data'])
+    return log
+
+# Watches events of a contract and new blocks. New logs come from a log filter (eth_newFilter), or from eth_getLogs if
+# the node does not support filters or has dropped ours. Every poll is one JSON-RPC batch with eth_blockNumber.
+class EventWatcher():
+    def __init__(self, contract_address, abi, events: list[str], pollInterval: float = 2):
+        self.decoder = get_event_decoder(contract_address, abi)
+        self.pollInterval = pollInterval
+        self._params = {"address": contract_address, "topics": [["0x" + event_abi_to_log_topic(e).hex() for e in abi if e.get('type') == 'event' and e['name'] in events]]}
+        self.block = web3.eth.block_number
+        self._filterId = None
+        try:
+            self._filterId = RpcBatch().request("eth_newFilter", [{**self._params, "fromBlock": hex(self.block + 1)}]).result()
+        except Exception as e:
+            print(f"Log filters are not available ({e}), polling with eth_getLogs")
+
+    def poll(self) -> tuple[int, list]:
+        # (latest block number, events since the last poll). The header of the latest block also goes to the fee oracle,
+        # so that sending a transaction does not have to fetch it again
+        batch = RpcBatch()
+        header = batch.get_block("latest")
+        if self._filterId is not None:
+            logs = batch.request("eth_getFilterChanges", [self._filterId])
+        else:
+            logs = batch.request("eth_getLogs", [{**self._params, "fromBlock": hex(self.block + 1), "toBlock": "latest"}])
+        header = header.result()
+        fee_oracle.on_block(header)
+        latest = header["number"]
+        try:
+            logs = [_format_log(log) for log in logs.result()]
+        except Exception as e:
+            if self._filterId is not None:
+                # e.g. "filter not found" after the node dropped an idle filter, catch up from the last block we saw
+                print(f"Lost the log filter ({e}), polling with eth_getLogs")
+                self._filterId = None
+            return self.block, []
+        self.block = max([latest] + [log['blockNumber'] for log in logs])
+        return self.block, self.decoder.decode_logs(logs)
+
+    def wait(self, timeout: float | None = None) -> tuple[int, list]:
+        # blocks until there is a new block or a new event (or the timeout expired)
+        start = monotonic()
+        block = self.block
+        while True:
+            latest, events = self.poll()
+            if events or latest != block or (timeout is not None and monotonic() - start >= timeout):
+                return latest, events
+            sleep(self.pollInterval)
+
+    def close(self):
+        if self._filterId is not None:
+            try:
+                RpcBatch().request("eth_uninstallFilter", [self._filterId]).result()
+            except Exception:
+                pass # the node dropped it already
+            self._filterId = None
+
+# Multicall3 (aggregate3) is deployed at this address on most chains, game/src/Multicall.sol is the same for devnets
+MULTICALL3_ADDRESS = "0xcA11bde05977b3631167028862bE2a173976CA11"
+MULTICALL3_ABI = [{
+    "type": "function", "name": "aggregate3", "stateMutability": "payable",
+    "inputs": [{"name": "calls", "type": "tuple[]", "components": [
+        {"name": "target", "type": "address"}, {"name": "allowFailure", "type": "bool"}, {"name": "callData", "type": "bytes"}]}],
+    "outputs": [{"name": "returnData", "type": "tuple[]", "components": [
+        {"name": "success", "type": "bool"}, {"name": "returnData", "type": "bytes"}]}],
+}]
+
+class _MulticallChunk():
+    # result of one aggregate3 eth_call in a batch, hands the decoded results of its calls to their BatchResults
+    def __init__(self, calls: list, results: list):
+        self.calls = calls
+        self.results = results
+        self._done = False
+
+    def done(self) -> bool:
+        return self._done
+
+    def set_result(self, returnData: list):
+        self._done = True
+        for (contract_address, abi, function_name, args), result, (success, data) in zip(self.calls, self.results, returnData):
+            try:
+                if not success:
+                    raise ContractLogicError(f"{function_name}{tuple(args)} on {contract_address} reverted", data="0x" + data.hex())
+                result.set_result(_decode_return(abi, function_name, data))
+            except Exception as e:
+                result.set_exception(e)
+
+    def set_exception(self, error: Exception):
+        self._done = True
+        for result in self.results:
+            result.set_exception(error)
+
+# Reads many contract functions with few eth_calls: the calls are aggregated into aggregate3 calls of at most
+# maxCalls each (choose it so that a chunk stays below the gas limit of eth_call), and all chunks go out in one
+# JSON-RPC batch. A reverting call only fails its own result.
+class Multicall():
+    def __init__(self, address = MULTICALL3_ADDRESS, maxCalls: int = 500):
+        self.address = address
+        self.maxCalls = maxCalls
+
+    def aggregate(self, calls: list, batch: RpcBatch | None = None, maxCalls: int | None = None, block = "latest") -> list[BatchResult]:
+        # calls are (contract address, abi, function name, args), pass `batch` to send them together with other requests
+        batch = RpcBatch() if batch is None else batch
+        maxCalls = self.maxCalls if maxCalls is None else maxCalls
+        results = [BatchResult(batch) for _ in calls]
+        for i in range(0, len(calls), maxCalls):
+            chunk = calls[i:i + maxCalls]
+            data = _encode_call(MULTICALL3_ABI, "aggregate3", [[(contract_address, True, _encode_call(abi, function_name, args)) for contract_address, abi, function_name, args in chunk]])
+            batch._add("eth_call", [{"to": self.address, "data": "0x" + data.hex()}, _block_id(block)], lambda r: _decode_call(MULTICALL3_ABI, "aggregate3", r), _MulticallChunk(chunk, results[i:i + maxCalls]))
+        return results
+
+# Async batching on L1.async_web3: requests made in the same iteration of the event loop go out as one batch, so
+# e.g. asyncio.gather over the reads of many games costs one round trip.
+class AsyncRpcBatcher(_Batch):
+    def __init__(self, maxSize: int = 100):
+        super().__init__(maxSize)
+        self._tasks = set() # keeps the running executes alive
+
+    def request(self, method: str, params: list, decode = lambda r: r) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        result = loop.create_future()
+        with self._lock:
+            self._requests.append((method, params, decode, result))
+            first = len(self._requests) == 1
+        if first:
+            # runs once the coroutines that are ready in this iteration had their turn
+            task = loop.create_task(self.execute())
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return result
+
+    async def _execute_chunk(self, chunk: list):
+        try:
+            responses = await async_web3.provider.make_batch_request([(method, params) for method, params, _, _ in chunk])
+        except Exception as e:
+            __class__._fail(chunk, e)
+            return
+        __class__._route(chunk, responses)
+
+    async def execute(self):
+        requests = self._take()
+        await asyncio.gather(*[self._execute_chunk(requests[i:i + self.maxSize]) for i in range(0, len(requests), self.maxSize)])
+
+_async_batcher = None
+def get_async_batcher() -> AsyncRpcBatcher:
+    global _async_batcher
+    if _async_batcher is None:
+        _async_batcher = AsyncRpcBatcher()
+    return _async_batcher
+
+async def interact_call_async(contract_address, abi, function_name: str, args: list):
+    return await get_async_batcher().call(contract_address, abi, function_name, args)
+
+async def interact_read_async(contract_address, abi, variable_name: str):
+    return await get_async_batcher().call(contract_address, abi, variable_name)
+
+async def _send_signed_async(tx: dict, private_key, nonces: NonceManager, fresh: bool = True):
+    signed_tx = Account.sign_transaction(tx, private_key=private_key)
+    try:
+        return await async_web3.eth.send_raw_transaction(signed_tx.raw_transaction)
+    except Exception as e:
+        nonces.rejected(tx["nonce"], e, fresh)
+        raise
+
+async def submit_transact_async(contract_address, abi, function_name: str, args: list, address, private_key, value: int = 0, overrideGas: int|None = None, nonce: int|None = None):
+    f = get_async_function(contract_address, abi, function_name)
+    if overrideGas is None:
+        overrideGas = await gas_model.limit_async(contract_address, function_name, lambda: f(*args).estimate_gas({"from": address, "value": value}))
+
+    max_fee_per_gas, priority_fee = await fee_oracle.fees_async()
+
+    nonces = get_nonce_manager(address)
+    txPreset = {
+        "chainId": chain_id,
+        "from": address,
+        "value": value,
+        "nonce": await nonces.next_nonce_async() if nonce is None else nonce,
+        "gas": overrideGas,
+        "maxFeePerGas": max_fee_per_gas,
+        "maxPriorityFeePerGas": priority_fee,
+        "type": 2,
+    }
+    print(f"Sending value {value}")
+
+    try:
+        tx = await f(*args).build_transaction(txPreset)
+    except Exception:
+        if nonce is None:
+            nonces.failed(txPreset["nonce"])
+        raise
+
+    tx_hash = await _send_signed_async(tx, private_key, nonces, nonce is None)
+    _track_submitted(tx_hash, (function_name, tx["gas"], monotonic(), fee_oracle.block))
+    return tx_hash
+
+async def wait_transact_async(contract_address, abi, function_name: str, args: list, tx_hash):
+    tx_receipt = await _wait_for_receipt_async(tx_hash)
+
+    decoded_events = get_async_event_decoder(contract_address, abi).decode_logs(tx_receipt.logs)
+    for dec in decoded_events:
+        print(f"EMITTED: {dec['event']}: {dec['args']}")
+
+    if tx_receipt.status == 1:
+        gas_model.observe(contract_address, function_name, tx_receipt.gasUsed)
+    _log_receipt(contract_address, function_name, tx_hash, tx_receipt)
+
+    if tx_receipt.status == 0:
+        print("TX FAILED")
+        assert False
+    return tx_receipt, decoded_events
+
+async def interact_transact_async(contract_address, abi, function_name: str, args: list, address, private_key, value: int = 0, overrideGas: int|None = None):
+    tx_hash = await submit_transact_async(contract_address, abi, function_name, args, address, private_key, value, overrideGas)
+    return await wait_transact_async(contract_address, abi, function_name, args, tx_hash)
+
+async def interact_send_async(contract_address, value: int, address, private_key):
+    max_fee_per_gas, priority_fee = await fee_oracle.fees_async()
+    gas = await gas_model.limit_async(contract_address, "send", lambda: async_web3.eth.estimate_gas({"to": contract_address, "from": address, "value": value}))
+
+    nonces = get_nonce_manager(address)
+    tx = {
+        "chainId": chain_id,
+        "to": contract_address,
+        "from": address,
+        "value": value,
+        "nonce": await nonces.next_nonce_async(),
+        "gas": gas,
+        "maxFeePerGas": max_fee_per_gas,
+        "maxPriorityFeePerGas": priority_fee,
+        "type": 2,
+    }
+    print(f"SENDING {value} WEI")
+
+    tx_hash = await _send_signed_async(tx, private_key, nonces)
+    _track_submitted(tx_hash, ("send", tx["gas"], monotonic(), fee_oracle.block))
+
+    tx_receipt = await _wait_for_receipt_async(tx_hash)
+    if tx_receipt.status == 1:
+        gas_model.observe(contract_address, "send", tx_receipt.gasUsed)
+    _log_receipt(contract_address, "send", tx_hash, tx_receipt)
+
+    if tx_receipt.status == 0:
+        print("TX FAILED")
+        assert False
+
+    return tx_receipt
+
 class L1Identity():
     def __init__(self, address):
         self.address = address
@@ -133,19 +1337,31 @@ class OwnedL1Identity(L1Identity):
     def __init__(self, private_key):
         self.private_key = private_key
 
-        account = web3.eth.account.from_key(private_key)
+        account = Account.from_key(private_key)
         super().__init__(account.address)
+        self.nonces = get_nonce_manager(self.address)
 
 class Contract():
     def __init__(self, contract_address, contract_abi):
         global web3
         self.address = contract_address
         self.abi = contract_abi
-        self.contract = web3.eth.contract(address=contract_address, abi=contract_abi)
+        self.contract = get_contract(contract_address, contract_abi)
 
     def _interact(self, user: OwnedL1Identity, method: str, args: list = [], value: int = 0, overrideGas: int|None = None):
         return interact_transact(self.address, self.abi, method, args, user.address, user.private_key, value, overrideGas)
     
+    # broadcast without waiting, e.g. to have resolves in several games in flight at once. Finish with _wait
+    def _submit(self, user: OwnedL1Identity, method: str, args: list = [], value: int = 0, overrideGas: int|None = None):
+        return submit_transact(self.address, self.abi, method, args, user.address, user.private_key, value, overrideGas)
+
+    def _wait(self, tx_hash, method: str, args: list = []):
+        return wait_transact(self.address, self.abi, method, args, tx_hash)
+
+    # broadcast and get a future of (receipt, decoded events), see ConfirmationTracker
+    def _submit_tracked(self, user: OwnedL1Identity, method: str, args: list = [], value: int = 0, overrideGas: int|None = None):
+        return submit_tracked(self.address, self.abi, method, args, user.address, user.private_key, value, overrideGas)
+
     def _send(self, user: OwnedL1Identity, value: int = 0):
         return interact_send(self.address, value, user.address, user.private_key)
     
@@ -161,26 +1377,78 @@ class Contract():
     def _storage(self, slot: int):
         return web3.eth.get_storage_at(self.address, slot)
     
-    def _storagedump(self, slots: int):
+    def _storagedump(self, slots: int, block = "latest"):
+        # the first `slots` slots (or the given list of slots), read in batches, see storagereader.py for decoding
         print(f"Dumping storage for contract {self.address}:")
-        for slot in range(slots):
-            print(f" {slot}: {self._storage(slot).hex()}")
+        for slot, value in read_storage(self.address, range(slots) if isinstance(slots, int) else slots, block).items():
+            print(f" {slot}: {value.hex()}")
     
     def as_object(self) -> dict:
         return {'address': self.address, 'abi': self.abi, 'type': 'Contract'}
     
-    def decode_logs(self, logs: list): # TODO: Make this better
-        ret = []
-        for event in self.contract.events:
-            for log in logs:
-                try:
-                    dec = event().process_log(log)
-                    ret.append(dec)
-                except:
-                    pass
+    def decode_logs(self, logs: list):
         # NOTE: Keep in mind that this contract might not be able to decode all events of a transaction! 
-        #  It might be the case that some events have been emitted by other contracts.
-        return ret
+        #  It might be the case that some events have been emitted by other contracts. These are skipped.
+        return get_event_decoder(self.address, self.abi).decode_logs(logs)
     
     def __repr__(self):
-        return f"<Contract @{self.address}>"
\ No newline at end of file
+        return f"<Contract @{self.address}>"
+
+# L1Identity and Contract on L1.async_web3, the methods that talk to the node are coroutines
+class AsyncL1Identity(L1Identity):
+    async def _balance(self):
+        return await async_web3.eth.get_balance(self.address)
+
+    async def print_balance(self):
+        balance = await self._balance()
+        print(f"Balance of {self.address}: {balance / 1e18} ETH ({balance})")
+
+class AsyncOwnedL1Identity(AsyncL1Identity, OwnedL1Identity):
+    pass
+
+# Not a subclass of Contract, so that none of the blocking methods on L1.web3 (e.g. _submit_tracked) are inherited
+class AsyncContract():
+    def __init__(self, contract_address, contract_abi):
+        self.address = contract_address
+        self.abi = contract_abi
+        self.contract = get_async_contract(contract_address, contract_abi)
+
+    async def _interact(self, user: OwnedL1Identity, method: str, args: list = [], value: int = 0, overrideGas: int|None = None):
+        return await interact_transact_async(self.address, self.abi, method, args, user.address, user.private_key, value, overrideGas)
+
+    async def _submit(self, user: OwnedL1Identity, method: str, args: list = [], value: int = 0, overrideGas: int|None = None):
+        return await submit_transact_async(self.address, self.abi, method, args, user.address, user.private_key, value, overrideGas)
+
+    async def _wait(self, tx_hash, method: str, args: list = []):
+        return await wait_transact_async(self.address, self.abi, method, args, tx_hash)
+
+    async def _send(self, user: OwnedL1Identity, value: int = 0):
+        return await interact_send_async(self.address, value, user.address, user.private_key)
+
+    async def _call(self, method: str, args: list = []):
+        return await interact_call_async(self.address, self.abi, method, args)
+
+    async def _read(self, variable: str):
+        return await interact_read_async(self.address, self.abi, variable)
+
+    async def _balance(self):
+        return await get_async_batcher().get_balance(self.address)
+
+    async def _storage(self, slot: int):
+        return await get_async_batcher().get_storage_at(self.address, slot)
+
+    async def _storagedump(self, slots: int):
+        print(f"Dumping storage for contract {self.address}:")
+        values = await asyncio.gather(*[self._storage(slot) for slot in range(slots)])
+        for slot, value in enumerate(values):
+            print(f" {slot}: {value.hex()}")
+
+    def as_object(self) -> dict:
+        return {'address': self.address, 'abi': self.abi, 'type': 'AsyncContract'}
+
+    def decode_logs(self, logs: list):
+        # events of other contracts are skipped, see Contract.decode_logs
+        return get_async_event_decoder(self.address, self.abi).decode_logs(logs)
+
+    def __repr__(self):
+        return f"<AsyncContract @{self.address}>"
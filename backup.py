@@ -0,0 +1,82 @@
+# Compact binary board backups, see Board.to_bytes and Board.from_bytes.
+#
+# A record is
+#   magic 'ZB' | version (1 byte) | flags (1 byte) | board dimension (1 byte) | ship length (1 byte) | ship count (1 byte)
+#   | placement indices (1 or 2 bytes each, see bitboard.py) | randomness (32 bytes) | [commitment (32 bytes)]
+#   | [proof length (2 bytes) | proof] | crc32 of everything before (4 bytes)
+# with all integers big endian. A file of backups is a sequence of records.
+# The placement indices only make sense for the geometry they were written with, so decode checks it.
+import struct
+import zlib
+
+from geometry import Geometry
+
+MAGIC = b'ZB'
+VERSION = 2
+
+FLAG_COMMITMENT = 1
+FLAG_PROOF = 2
+FLAG_WIDE_INDICES = 4 # placement indices take 2 bytes, for boards with more than 256 placements
+
+HEADER = struct.Struct('>2sBBBBB')
+
+def encode(geometry: Geometry, indices: list[int], randomness: int, boardCommitment: int | None = None, proof: bytes | None = None) -> bytes:
+    wide = len(geometry.bitboard.placements) > 256
+    flags = (FLAG_COMMITMENT if boardCommitment is not None else 0) | (FLAG_PROOF if proof is not None else 0) | (FLAG_WIDE_INDICES if wide else 0)
+    out = bytearray(HEADER.pack(MAGIC, VERSION, flags, geometry.dimension, geometry.shipLength, len(indices)))
+    for index in indices:
+        out += index.to_bytes(2 if wide else 1)
+    out += randomness.to_bytes(32)
+    if boardCommitment is not None:
+        out += boardCommitment.to_bytes(32)
+    if proof is not None:
+        out += len(proof).to_bytes(2) + proof
+    out += zlib.crc32(out).to_bytes(4)
+    return bytes(out)
+
+def decode(data: bytes, geometry: Geometry, offset: int = 0) -> tuple[list[int], int, int | None, bytes | None, int]:
+    # returns placement indices, randomness, commitment, proof and the offset of the next record
+    if len(data) - offset < HEADER.size:
+        raise ValueError("Board backup is truncated")
+    magic, version, flags, dimension, shipLength, shipCount = HEADER.unpack_from(data, offset)
+    if magic != MAGIC:
+        raise ValueError("Not a board backup")
+    if version != VERSION:
+        raise ValueError(f"Unsupported board backup version {version}")
+    if (dimension, shipLength, shipCount) != (geometry.dimension, geometry.shipLength, geometry.shipCount):
+        raise ValueError(f"Board backup is for {shipCount} ships of length {shipLength} on a {dimension}x{dimension} board, not {geometry}")
+    pos = offset + HEADER.size
+
+    width = 2 if flags & FLAG_WIDE_INDICES else 1
+    indices = [int.from_bytes(data[pos + i * width:pos + (i + 1) * width]) for i in range(shipCount)]
+    pos += shipCount * width
+    randomness = int.from_bytes(data[pos:pos + 32])
+    pos += 32
+    boardCommitment = None
+    if flags & FLAG_COMMITMENT:
+        boardCommitment = int.from_bytes(data[pos:pos + 32])
+        pos += 32
+    proof = None
+    if flags & FLAG_PROOF:
+        length = int.from_bytes(data[pos:pos + 2])
+        proof = bytes(data[pos + 2:pos + 2 + length])
+        pos += 2 + length
+
+    if pos + 4 > len(data):
+        raise ValueError("Board backup is truncated")
+    if zlib.crc32(data[offset:pos]) != int.from_bytes(data[pos:pos + 4]):
+        raise ValueError("Board backup is corrupted")
+    if any(index >= len(geometry.bitboard.placements) for index in indices):
+        raise ValueError("Board backup has a ship that is not within the board")
+    return indices, randomness, boardCommitment, proof, pos + 4
+
+def is_backup(data: bytes) -> bool:
+    return data[0:2] == MAGIC
+
+def decode_all(data: bytes, geometry: Geometry):
+    # all records of a file of backups
+    data = memoryview(data)
+    offset = 0
+    while offset < len(data):
+        *record, offset = decode(data, geometry, offset)
+        yield record
@@ -0,0 +1,133 @@
+# Benchmark the board and attack circuits against the checked-in reference measurements in bench-reference.json
+# (metrics missing there are measured from the *-reference artifacts, if those allow it).
+# Fails (exit code 1) if a metric regresses by more than the given threshold. Metrics without a reference are only
+# printed, until they are recorded with --save-reference.
+#
+# python3 bench.py [--threshold 0.1] [--runs 5] [--circuit board] [--circuit attack] [--save-reference]
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+from subprocess import Popen, PIPE
+from time import perf_counter
+
+from snark import SimpleSnark, read_r1cs_header, round_sig
+from test import Board, ShipPlacement
+
+# a fixed, valid board so that all runs prove the same statement
+BENCH_SHIPS = [ShipPlacement(1, 1, 1), ShipPlacement(3, 3, 1), ShipPlacement(5, 5, 1)]
+BENCH_RANDOMNESS = 4533
+BENCH_TARGET = 1 * Board.BOARD_DIMENSION + 1
+
+# artifacts needed to compute a witness and a proof
+ARTIFACTS = ['out', 'out.r1cs', 'abi.json', 'proving.key', 'verification.key']
+
+REFERENCE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench-reference.json")
+
+# metrics that are compared against the reference, lower is better for all of them
+METRICS = ['constraints', 'setup', 'witness', 'proof', 'provingKeySize']
+
+def circuit_inputs(circuit: str) -> list:
+    board = Board.place_ships(BENCH_SHIPS)
+    boardCommitment = Board.GEOMETRY.commit(board, BENCH_RANDOMNESS)
+    if circuit == 'board':
+        return [boardCommitment, *BENCH_SHIPS, BENCH_RANDOMNESS]
+    elif circuit == 'attack':
+        isHit = (board & (1 << BENCH_TARGET)) > 0
+        boardDecomposition = Board.BITBOARD.decompose(board)
+        return [boardCommitment, BENCH_TARGET, isHit, boardDecomposition, BENCH_RANDOMNESS]
+    raise Exception(f"Unknown circuit {circuit}")
+
+def zokrates(args: list, cwd: str):
+    p = Popen(["zokrates", *args], cwd=cwd, stdout=PIPE, stdin=PIPE, stderr=PIPE)
+    stdout, stderr = p.communicate()
+    if p.returncode != 0:
+        raise Exception(f"zokrates {' '.join(args)} failed: {stdout.decode()}{stderr.decode()}")
+
+def timed(f) -> float:
+    startTime = perf_counter()
+    assert f() is not False, "zokrates step failed"
+    return perf_counter() - startTime
+
+def measure(dir: str, circuit: str, build: bool, runs: int = 1) -> dict:
+    # work on a copy, so that neither the sources nor the reference artifacts are touched
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in os.listdir(dir):
+            if name in ARTIFACTS or name.endswith('.zok'):
+                shutil.copy(os.path.join(dir, name), tmp)
+
+        results = {}
+        if build:
+            zokrates(["compile", "-i", "main.zok"], tmp)
+        results['constraints'] = read_r1cs_header(os.path.join(tmp, 'out.r1cs'))['constraints']
+
+        if not os.path.exists(os.path.join(tmp, 'out')):
+            # the compiled program is not always checked in, so we can neither run the setup nor compute a witness
+            results['provingKeySize'] = os.path.getsize(os.path.join(tmp, 'proving.key'))
+            return results
+
+        results['setup'] = min(timed(lambda: zokrates(["setup", "-s", "gm17"], tmp)) for _ in range(runs))
+        results['provingKeySize'] = os.path.getsize(os.path.join(tmp, 'proving.key'))
+
+        snark = SimpleSnark(tmp)
+        inputs = circuit_inputs(circuit)
+        results['witness'] = min(timed(lambda: snark.compute_witness(inputs)) for _ in range(runs))
+        results['proof'] = min(timed(snark.generate_proof) for _ in range(runs))
+        return results
+
+def load_reference() -> dict:
+    if not os.path.exists(REFERENCE_FILE):
+        return {}
+    with open(REFERENCE_FILE, 'r') as f:
+        return json.load(f)
+
+def save_reference(reference: dict):
+    with open(REFERENCE_FILE, 'w') as f:
+        json.dump(reference, f, indent=2)
+        f.write('\n')
+
+def compare(circuit: str, current: dict, reference: dict, threshold: float) -> bool:
+    ok = True
+    print(f"{circuit}:")
+    for metric in METRICS:
+        cur = current.get(metric)
+        ref = reference.get(metric)
+        if cur is None or ref is None:
+            print(f"  {metric:>16}: {'n/a' if cur is None else round_sig(cur)} (no reference, see --save-reference)")
+            continue
+        change = (cur - ref) / ref if ref > 0 else 0
+        regression = change > threshold
+        ok = ok and not regression
+        print(f"  {metric:>16}: {round_sig(cur)} (reference: {round_sig(ref)}, {change:+.1%}){' REGRESSION' if regression else ''}")
+    return ok
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the circuits against the reference artifacts")
+    parser.add_argument("--threshold", type=float, default=float(os.getenv("BENCH_THRESHOLD", "0.1")), help="maximum allowed relative regression (default 0.1 = 10%%)")
+    parser.add_argument("--runs", type=int, default=5, help="take the fastest of this many setup, witness and proof runs (default 5)")
+    parser.add_argument("--circuit", action="append", choices=["board", "attack"], help="circuit to benchmark, can be given multiple times (default: all)")
+    parser.add_argument("--save-reference", action="store_true", help=f"store the measurements as the new reference in {os.path.basename(REFERENCE_FILE)} (run it on the reference version)")
+    args = parser.parse_args()
+
+    references = load_reference()
+    ok = True
+    for circuit in args.circuit or ["board", "attack"]:
+        current = measure(circuit, circuit, build=True, runs=args.runs)
+        if args.save_reference:
+            references[circuit] = current
+            continue
+        reference = references.get(circuit, {})
+        if any(metric not in reference for metric in METRICS):
+            reference = {**measure(f"{circuit}-reference", circuit, build=False, runs=args.runs), **reference}
+        ok = compare(circuit, current, reference, args.threshold) and ok
+
+    if args.save_reference:
+        save_reference(references)
+        print(f"Saved the reference measurements to {REFERENCE_FILE}")
+        sys.exit(0)
+
+    if not ok:
+        print(f"Benchmark failed: regression above {args.threshold:.0%}")
+        sys.exit(1)
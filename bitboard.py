@@ -0,0 +1,111 @@
+import random
+
+# Bitboards for the game board: position (x, y) is bit y * dimension + x of an integer.
+# All legal ship placements are precomputed once, together with the mask of the fields they cover and the mask
+# of the fields another ship must not cover (the ship itself and all fields touching it, including diagonally).
+# Placing ships, checking for overlaps or touching ships and testing for hits then are single integer operations.
+
+class Bitboard():
+    def __init__(self, dimension: int, shipLength: int):
+        self.dimension = dimension
+        self.shipLength = shipLength
+        self.positions = dimension * dimension
+        self.full = (1 << self.positions) - 1
+
+        # placement index -> (startPointX, startPointY, directionSelector), vertical placements first.
+        # Like the original Python check (start + SHIP_LENGTH < BOARD_DIMENSION), ships must not end in the last row or
+        # column: the board circuit has not been shown to accept those placements
+        self.placements = []
+        for directionSelector in (False, True):
+            width = dimension - shipLength if directionSelector else dimension
+            height = dimension if directionSelector else dimension - shipLength
+            for y in range(height):
+                for x in range(width):
+                    self.placements.append((x, y, directionSelector))
+        self.indices = {p: i for i, p in enumerate(self.placements)}
+
+        self.shipMasks = [self._ship_mask(*p) for p in self.placements]
+        self.neighborhoodMasks = [self._neighborhood_mask(m) for m in self.shipMasks]
+
+    def _ship_mask(self, x: int, y: int, directionSelector: bool) -> int:
+        step = 1 if directionSelector else self.dimension
+        pos = y * self.dimension + x
+        return sum(1 << (pos + i * step) for i in range(self.shipLength))
+
+    def _neighborhood_mask(self, mask: int) -> int:
+        # grow the mask by one field in every direction, without wrapping around the left and right border
+        notLeftColumn = self.full & ~sum(1 << (y * self.dimension) for y in range(self.dimension))
+        notRightColumn = self.full & ~sum(1 << (y * self.dimension + self.dimension - 1) for y in range(self.dimension))
+        rows = mask | ((mask << 1) & notLeftColumn) | ((mask >> 1) & notRightColumn)
+        return (rows | (rows << self.dimension) | (rows >> self.dimension)) & self.full
+
+    def placement_index(self, x: int, y: int, directionSelector) -> int | None:
+        # None if the ship does not fit on the board
+        return self.indices.get((x, y, bool(directionSelector)))
+
+    def touches(self, board: int, index: int) -> bool:
+        # True if the ship would overlap or touch any ship already on the board
+        return (board & self.neighborhoodMasks[index]) != 0
+
+    def layout_mask(self, indices: list[int]) -> int | None:
+        # the board of a layout, or None if any two ships overlap or touch
+        board = 0
+        for i in indices:
+            if self.touches(board, i):
+                return None
+            board |= self.shipMasks[i]
+        return board
+
+    def sample_layout(self, shipCount: int, rng = random) -> list[int]:
+        # Uniformly random valid layout (ordered placement indices). Rejection sampling is fine here: checking a layout
+        # costs a few integer operations and a sizeable fraction of all layouts is valid
+        while True:
+            indices = [rng.randrange(len(self.placements)) for _ in range(shipCount)]
+            if self.layout_mask(indices) is not None:
+                return indices
+
+    def count_layouts(self, shipCount: int, indices: list[int] | None = None) -> int:
+        # number of valid ordered layouts using only the given placements (default: all)
+        if indices is None:
+            indices = range(len(self.placements))
+        # compatible[i] has bit j set if placement j neither overlaps nor touches placement i
+        compatible = {i: sum(1 << j for j in indices if not self.shipMasks[j] & self.neighborhoodMasks[i]) for i in indices}
+
+        def count(k: int, candidates: int) -> int:
+            # number of ways to place k more ships on the candidate placements
+            if k == 0:
+                return 1
+            total = 0
+            for i in indices:
+                if (candidates >> i) & 1:
+                    total += count(k - 1, candidates & compatible[i])
+            return total
+        return count(shipCount, sum(1 << i for i in indices))
+
+    def is_hit(self, board: int, position: int) -> bool:
+        return (board >> position) & 1 == 1
+
+    def decompose(self, board: int) -> list[bool]:
+        # bit i of the board is element i of the decomposition
+        return [c == '1' for c in reversed(format(board, f'0{self.positions}b'))]
+
+    def compose(self, decomposition: list[bool]) -> int:
+        return int(''.join('1' if b else '0' for b in reversed(decomposition)), 2)
+
+    def render(self, board: int, marks: str = '.X') -> str:
+        # one row per line, marks[0] for unset and marks[1] for set fields
+        bits = ''.join(reversed(format(board, f'0{self.positions}b'))).translate(str.maketrans('01', marks))
+        return ''.join(bits[y * self.dimension:(y + 1) * self.dimension] + '\n' for y in range(self.dimension))
+
+DEFAULT = Bitboard(11, 3)
+
+if __name__ == "__main__":
+    # expected number of proofs generated per board, before and after sampling valid layouts in Python
+    SHIP_COUNT = 3
+    valid = DEFAULT.count_layouts(SHIP_COUNT)
+    print(f"{len(DEFAULT.placements)} placements, {valid} valid ordered layouts of {SHIP_COUNT} ships ({valid / len(DEFAULT.placements) ** SHIP_COUNT:.1%} of all)")
+
+    # Board.create_new used to draw each ship uniformly from the placements and only found out whether the layout is
+    # valid when zokrates failed to compute the witness
+    print(f"before: {len(DEFAULT.placements) ** SHIP_COUNT / valid:.2f} expected proofs per board ({valid / len(DEFAULT.placements) ** SHIP_COUNT:.1%} of the sampled layouts are valid)")
+    print(f"after:  1.00 expected proofs per board (layouts are validated before proving)")
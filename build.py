@@ -0,0 +1,104 @@
+# Build circuits through a content-addressed artifact cache.
+# The cache key is the hash of the circuit's .zok sources, the zokrates version and the proving scheme, so a
+# rebuild only happens if something semantically changed. Circuits that do have to be rebuilt are built in parallel.
+#
+# python3 build.py [--reference] [--scheme gm17] [circuit dirs, default: board attack]
+import argparse
+import hashlib
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from subprocess import Popen, PIPE
+from time import perf_counter
+
+from snark import round_sig
+
+CACHE_DIR = os.getenv("ZK_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".zkcache"))
+
+# everything zokrates compile, setup and export-verifier produce
+ARTIFACTS = ['out', 'out.r1cs', 'abi.json', 'proving.key', 'verification.key', 'verifier.sol']
+
+def zokrates(args: list, cwd: str | None = None) -> str:
+    p = Popen(["zokrates", *args], cwd=cwd, stdout=PIPE, stdin=PIPE, stderr=PIPE)
+    stdout, stderr = p.communicate()
+    if p.returncode != 0:
+        raise Exception(f"zokrates {' '.join(args)} failed: {stdout.decode()}{stderr.decode()}")
+    return stdout.decode()
+
+_zokrates_version = None
+def zokrates_version() -> str:
+    global _zokrates_version
+    if _zokrates_version is None:
+        _zokrates_version = zokrates(["--version"]).strip()
+    return _zokrates_version
+
+def source_files(dir: str) -> list[str]:
+    return sorted(os.path.relpath(os.path.join(root, name), dir) for root, _, names in os.walk(dir) for name in names if name.endswith('.zok'))
+
+def cache_key(dir: str, scheme: str) -> str:
+    h = hashlib.sha256()
+    h.update(zokrates_version().encode() + b'\0' + scheme.encode() + b'\0')
+    for name in source_files(dir):
+        with open(os.path.join(dir, name), 'rb') as f:
+            content = f.read()
+        # include the file name, so that renaming a module is a change as well
+        h.update(name.encode() + b'\0' + len(content).to_bytes(8) + content)
+    return h.hexdigest()
+
+def _copy_artifacts(src: str, dst: str):
+    for name in ARTIFACTS:
+        shutil.copy(os.path.join(src, name), os.path.join(dst, name))
+
+# make sure the artifacts of the circuit in `dir` are up to date, returns True on a cache hit
+def build(dir: str, scheme: str = "gm17") -> bool:
+    key = cache_key(dir, scheme)
+    entry = os.path.join(CACHE_DIR, key)
+    if os.path.isdir(entry):
+        _copy_artifacts(entry, dir)
+        print(f"{dir}: restored from cache ({key[:12]})")
+        return True
+
+    startTime = perf_counter()
+    # build in a scratch directory so that a failing build never leaves half-written artifacts behind
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in source_files(dir):
+            os.makedirs(os.path.join(tmp, os.path.dirname(name)), exist_ok=True)
+            shutil.copy(os.path.join(dir, name), os.path.join(tmp, name))
+        zokrates(["compile", "-i", "main.zok"], tmp)
+        zokrates(["setup", "-s", scheme], tmp)
+        zokrates(["export-verifier"], tmp)
+
+        # publish the cache entry atomically, a concurrent build of the same sources simply wins or loses the rename
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        staging = tempfile.mkdtemp(dir=CACHE_DIR)
+        _copy_artifacts(tmp, staging)
+        try:
+            os.rename(staging, entry)
+        except OSError:
+            shutil.rmtree(staging)
+        _copy_artifacts(tmp, dir)
+    print(f"{dir}: built in {round_sig(perf_counter() - startTime)} seconds ({key[:12]})")
+    return False
+
+# copy the artifacts (but not the sources) into <dir>-reference, which is what the game application uses
+def export_reference(dir: str):
+    reference = dir.rstrip('/') + '-reference'
+    os.makedirs(reference, exist_ok=True)
+    _copy_artifacts(dir, reference)
+    shutil.copy(os.path.join(dir, 'Makefile'), reference)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build circuits using the artifact cache")
+    parser.add_argument("dirs", nargs="*", default=["board", "attack"], help="circuit directories (default: board attack)")
+    parser.add_argument("--scheme", default="gm17", help="proving scheme passed to zokrates setup (default: gm17)")
+    parser.add_argument("--reference", action="store_true", help="also copy the artifacts into <dir>-reference")
+    args = parser.parse_args()
+
+    # the circuits are independent of each other, zokrates is the bottleneck and runs in its own process
+    with ThreadPoolExecutor(max_workers=len(args.dirs)) as pool:
+        list(pool.map(lambda dir: build(dir, args.scheme), args.dirs))
+
+    if args.reference:
+        for dir in args.dirs:
+            export_reference(dir)
@@ -0,0 +1,124 @@
+# Record and replay JSON-RPC traffic, so that the client can be profiled and benchmarked without a node.
+# RecordingProvider wraps the provider of a real session (e.g. against local anvil) and writes every request with its
+# response and latency to a gzipped file of JSON lines. ReplayProvider serves the responses back, in the recorded
+# order per identical request (eth_blockNumber answers differently over time), with optional simulated latency.
+# Proofs and boards are random on every run, so transactions, gas estimates and the receipt lookups for the returned
+# hashes (ORDERED_METHODS) are matched by method and recorded order only, not by their parameters.
+# L1.make_provider uses them if RPC_CASSETTE is record:<file> or replay:<file>.
+#
+# python3 cassette.py <file>   prints the requests per method and the time spent waiting for the node
+import atexit
+import gzip
+import itertools
+import json
+import sys
+import threading
+from collections import defaultdict, deque
+from time import monotonic, sleep
+
+from web3.providers import JSONBaseProvider
+
+ORDERED_METHODS = {"eth_sendRawTransaction", "eth_sendTransaction", "eth_estimateGas", "eth_getTransactionReceipt", "eth_getTransactionByHash"}
+
+def request_key(method: str, params) -> str:
+    if method in ORDERED_METHODS:
+        return method
+    return method + json.dumps(params, sort_keys=True, separators=(',', ':'), default=str)
+
+def _strip_id(response: dict) -> dict:
+    return {k: v for k, v in response.items() if k != 'id'}
+
+class RecordingProvider(JSONBaseProvider):
+    def __init__(self, provider, file: str):
+        super().__init__()
+        self.provider = provider
+        self.file = file
+        self._lock = threading.Lock()
+        self._out = gzip.open(file, 'wt')
+        atexit.register(self.close)
+
+    def _record(self, entry: dict):
+        with self._lock:
+            if self._out is not None:
+                self._out.write(json.dumps(entry, separators=(',', ':'), default=str) + '\n')
+
+    def make_request(self, method, params):
+        startTime = monotonic()
+        response = self.provider.make_request(method, params)
+        self._record({'m': method, 'p': params, 'r': _strip_id(response), 't': round(monotonic() - startTime, 6)})
+        return response
+
+    def make_batch_request(self, requests):
+        startTime = monotonic()
+        responses = self.provider.make_batch_request(requests)
+        # a batch is one entry, with the list of requests as key
+        self._record({'b': [[method, params] for method, params in requests],
+            'r': [_strip_id(r) for r in responses] if isinstance(responses, list) else _strip_id(responses), 't': round(monotonic() - startTime, 6)})
+        return responses
+
+    def is_connected(self, show_traceback: bool = False) -> bool:
+        return self.provider.is_connected(show_traceback)
+
+    def close(self):
+        with self._lock:
+            if self._out is not None:
+                self._out.close()
+                self._out = None
+
+def read_cassette(file: str):
+    with gzip.open(file, 'rt') as f:
+        for line in f:
+            yield json.loads(line)
+
+def _entry_key(entry: dict) -> str:
+    if 'b' in entry:
+        return 'batch:' + ''.join(request_key(method, params) for method, params in entry['b'])
+    return request_key(entry['m'], entry['p'])
+
+class ReplayProvider(JSONBaseProvider):
+    # latencyScale 1 sleeps as long as the node took when recording, 0 not at all. `latency` is added to every request.
+    def __init__(self, file: str, latencyScale: float = 0, latency: float = 0):
+        super().__init__()
+        self.latencyScale = latencyScale
+        self.latency = latency
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._responses = defaultdict(deque) # request key -> recorded (response, latency) in order
+        for entry in read_cassette(file):
+            self._responses[_entry_key(entry)].append((entry['r'], entry['t']))
+
+    def _replay(self, key: str, description: str):
+        with self._lock:
+            responses = self._responses.get(key)
+            assert responses, f"{description} is not in the cassette"
+            # the last answer to a request is repeated, e.g. if the client polls more often than when recording
+            response, latency = responses.popleft() if len(responses) > 1 else responses[0]
+        delay = latency * self.latencyScale + self.latency
+        if delay > 0:
+            sleep(delay)
+        return response
+
+    def _with_id(self, response: dict) -> dict:
+        return {**response, 'id': next(self._ids)}
+
+    def make_request(self, method, params):
+        return self._with_id(self._replay(request_key(method, params), f"{method} {params}"))
+
+    def make_batch_request(self, requests):
+        key = 'batch:' + ''.join(request_key(method, params) for method, params in requests)
+        responses = self._replay(key, f"Batch of {[method for method, _ in requests]}")
+        return [self._with_id(r) for r in responses] if isinstance(responses, list) else self._with_id(responses)
+
+    def is_connected(self, show_traceback: bool = False) -> bool:
+        return True
+
+if __name__ == "__main__":
+    count = defaultdict(int)
+    latency = defaultdict(float)
+    for entry in read_cassette(sys.argv[1]):
+        method = 'batch' if 'b' in entry else entry['m']
+        count[method] += 1
+        latency[method] += entry['t']
+    for method in sorted(count, key=lambda m: -latency[m]):
+        print(f"{method}: {count[method]} requests, {round(latency[method], 3)} seconds")
+    print(f"Total: {sum(count.values())} requests, {round(sum(latency.values()), 3)} seconds waiting for the node")
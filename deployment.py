@@ -0,0 +1,22 @@
+# The deployments of the game contract: Sepolia (ETH_RPC_URL overrides the endpoint) or, with LOCAL=1, the local anvil
+# devnet. The block is the one the contract was deployed in (see game/broadcast), the local address is the one of the
+# first deployment on a fresh devnet.
+import os
+
+import L1
+
+SEPOLIA_GAME = {"rpc": "https://ethereum-sepolia-public.nodies.app", "chainId": 11155111, "address": "0x59134804d0Cf3ed908f0f2B6caA55E9D3d9Ac29c", "block": 9269124}
+LOCAL_GAME = {"rpc": "http://127.0.0.1:8545", "chainId": 31337, "address": "0xDc64a140Aa3E981100a9becA4E685f962f0cF6C9", "block": 0}
+
+def game_deployment() -> dict:
+    return SEPOLIA_GAME if int(os.getenv('LOCAL', '0')) == 0 else LOCAL_GAME
+
+def artifact_file(contract: str = "Game") -> str:
+    # the forge build output of the contract
+    return f"game/out/{contract}.sol/{contract}.json"
+
+def connect_game(contract: str = "Game") -> L1.Contract:
+    # connect L1.web3 to the deployment and return the game contract
+    d = game_deployment()
+    L1.connect(os.getenv("ETH_RPC_URL", d["rpc"]) if d is SEPOLIA_GAME else d["rpc"], d["chainId"])
+    return L1.Contract(d["address"], L1.load_abi(artifact_file(contract)))
@@ -0,0 +1,106 @@
+# Differential fuzzer between the Python board rules (bitboard.py) and the board circuit.
+# Draws layouts, asks the Python oracle whether they are valid and checks that the circuit agrees by computing the
+# witness only (no proof). Any disagreement is shrunk to a minimal counterexample.
+#
+# python3 fuzz.py [--iterations 1000] [--batch 32] [--seed 1] [--circuit board-reference]
+import argparse
+import os
+import random
+import sys
+from time import perf_counter
+
+from snark import SimpleSnark, SnarkPool, worker_snark, round_sig
+from test import Board, ShipPlacement
+
+# a layout is a tuple of (startPointX, startPointY, directionSelector) per ship
+
+def oracle(layout) -> bool:
+    indices = [Board.BITBOARD.placement_index(*ship) for ship in layout]
+    return None not in indices and Board.BITBOARD.layout_mask(indices) is not None
+
+def layout_board(layout) -> int:
+    # what an honest Python prover would commit to: the sum of the ships that fit on the board
+    board = 0
+    for ship in layout:
+        index = Board.BITBOARD.placement_index(*ship)
+        if index is not None:
+            board += Board.BITBOARD.shipMasks[index]
+    return board
+
+def circuit_inputs(layout, randomness: int) -> list:
+    return [Board.GEOMETRY.commit(layout_board(layout), randomness), *[ShipPlacement(*ship) for ship in layout], randomness]
+
+def _witness_accepts(case) -> bool:
+    layout, randomness = case
+    return worker_snark().compute_witness(circuit_inputs(layout, randomness))
+
+def draw(rng: random.Random):
+    b = Board.BITBOARD
+    kind = rng.randrange(3)
+    if kind == 0:
+        # valid layout
+        layout = [b.placements[i] for i in b.sample_layout(Board.SHIP_COUNT, rng)]
+    else:
+        layout = [b.placements[rng.randrange(len(b.placements))] for _ in range(Board.SHIP_COUNT)]
+    if kind == 2:
+        # move one ship by a field, which mostly hits the borders and the touching rules
+        s = rng.randrange(Board.SHIP_COUNT)
+        x, y, directionSelector = layout[s]
+        dx, dy = rng.choice([(-1, 0), (1, 0), (0, -1), (0, 1), (1, 1), (-1, -1)])
+        layout[s] = (min(max(x + dx, 0), b.dimension - 1), min(max(y + dy, 0), b.dimension - 1), directionSelector)
+    return tuple(layout), rng.randrange(2 ** 32)
+
+def shrink_candidates(layout, randomness: int):
+    # simpler versions of the case: smaller randomness, coordinates closer to 0, vertical instead of horizontal ships
+    if randomness != 0:
+        yield layout, 0
+    for s, (x, y, directionSelector) in enumerate(layout):
+        candidates = [(v, y, directionSelector) for v in (0, x // 2, x - 1) if 0 <= v < x]
+        candidates += [(x, v, directionSelector) for v in (0, y // 2, y - 1) if 0 <= v < y]
+        if directionSelector:
+            candidates.append((x, y, False))
+        for ship in candidates:
+            yield layout[:s] + (ship,) + layout[s + 1:], randomness
+
+def shrink(pool: SnarkPool, layout, randomness: int) -> tuple:
+    while True:
+        candidates = list(shrink_candidates(layout, randomness))
+        accepted = pool.map(_witness_accepts, candidates)
+        for (l, r), a in zip(candidates, accepted):
+            if a != oracle(l):
+                layout, randomness = l, r
+                break
+        else:
+            return layout, randomness
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Differential fuzzer between the Python board rules and the board circuit")
+    parser.add_argument("--iterations", type=int, default=1000)
+    parser.add_argument("--batch", type=int, default=32, help="number of witnesses computed in parallel")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--circuit", default="board-reference", help="directory of the compiled board circuit")
+    args = parser.parse_args()
+
+    seed = args.seed if args.seed is not None else random.randrange(2 ** 32)
+    print(f"Fuzzing {args.circuit} with seed {seed}")
+    rng = random.Random(seed)
+
+    witnesses = 0
+    disagreements = []
+    startTime = perf_counter()
+    with SnarkPool(SimpleSnark(args.circuit), min(args.batch, os.cpu_count() or 1)) as pool:
+        while witnesses < args.iterations and not disagreements:
+            cases = [draw(rng) for _ in range(min(args.batch, args.iterations - witnesses))]
+            accepted = pool.map(_witness_accepts, cases)
+            witnesses += len(cases)
+            disagreements = [case for case, a in zip(cases, accepted) if a != oracle(case[0])]
+            print(f"{witnesses} witnesses, {round_sig(witnesses / (perf_counter() - startTime))} witnesses per second")
+
+        if not disagreements:
+            print(f"No disagreement in {witnesses} cases")
+            sys.exit(0)
+
+        layout, randomness = shrink(pool, *disagreements[0])
+    print(f"Disagreement: Python says {'valid' if oracle(layout) else 'invalid'}, the circuit {'rejects' if oracle(layout) else 'accepts'} the layout {layout} with randomness {randomness}")
+    print(Board.BITBOARD.render(layout_board(layout)))
+    sys.exit(1)
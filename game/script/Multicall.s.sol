@@ -0,0 +1,20 @@
+// SPDX-License-Identifier: UNLICENSED
+pragma solidity ^0.8.13;
+
+import {Script, console} from "forge-std/Script.sol";
+import {Multicall} from "../src/Multicall.sol";
+
+contract MulticallScript is Script {
+    Multicall public multicall;
+
+    function setUp() public {}
+
+    function run() public {
+        vm.startBroadcast();
+
+        multicall = new Multicall();
+        console.log("Multicall deployed at", address(multicall));
+
+        vm.stopBroadcast();
+    }
+}
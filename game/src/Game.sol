@@ -4,9 +4,11 @@ pragma solidity ^0.8.0;
 import {Verifier as BoardVerifier} from "./BoardVerifier.sol"; 
 import {Verifier as AttackVerifier} from "./AttackVerifier.sol"; 
 
+// the board geometry has to match the circuits and geometry.py
 uint constant BOARD_DIMENSION = 11;
 uint constant SHIP_COUNT = 3;
 uint constant SHIP_LENGTH = 3;
+uint constant BOARD_POSITIONS = BOARD_DIMENSION * BOARD_DIMENSION;
 uint constant TIMEOUT_PERIOD = 100; // in blocks, a constant for now
 uint8 constant NO_TARGET = 255;
 
@@ -40,6 +42,9 @@ contract Game {
     AttackVerifier attackVerifier;
 
     constructor(BoardVerifier _boardVerifier, AttackVerifier _attackVerifier) {
+        // the turn counter, the hit counters and the target are uint8, which limits boards to 127 positions
+        require(2 * BOARD_POSITIONS <= type(uint8).max, "Board too large");
+        require(SHIP_COUNT * SHIP_LENGTH <= type(uint8).max, "Too many ship parts");
         boardVerifier = _boardVerifier;
         attackVerifier = _attackVerifier;
     }
@@ -61,7 +66,7 @@ contract Game {
         if (msg.value > 0) {
             curGame.stake = msg.value;
         }
-        curGame.target = 255;
+        curGame.target = NO_TARGET;
         emit NewGame(emptyGamePointer, msg.sender, player2, msg.value);
         emptyGamePointer += 1;
     }
@@ -140,7 +145,7 @@ contract Game {
         GameTracker storage game = games[gameId];
         require(game.gameEnded == false, "Game has ended");
         require(game.target == NO_TARGET, "Previous turn not yet resolved");
-        require(target < BOARD_DIMENSION * BOARD_DIMENSION, "Invalid target");
+        require(target < BOARD_POSITIONS, "Invalid target");
 
         if (game.turn % 2 == 0) {
             // this is player1's turn
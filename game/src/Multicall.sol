@@ -0,0 +1,27 @@
+// SPDX-License-Identifier: MIT
+pragma solidity ^0.8.0;
+
+// Aggregates many read calls into one eth_call, compatible with aggregate3 of Multicall3.
+// Public chains have Multicall3 at 0xcA11bde05977b3631167028862bE2a173976CA11 already, deploy this one on local
+// devnets with script/Multicall.s.sol.
+contract Multicall {
+    struct Call3 {
+        address target;
+        bool allowFailure;
+        bytes callData;
+    }
+
+    struct Result {
+        bool success;
+        bytes returnData;
+    }
+
+    function aggregate3(Call3[] calldata calls) external payable returns (Result[] memory returnData) {
+        returnData = new Result[](calls.length);
+        for (uint i = 0; i < calls.length; i++) {
+            (bool success, bytes memory ret) = calls[i].target.call(calls[i].callData);
+            require(success || calls[i].allowFailure, "Multicall: call failed");
+            returnData[i] = Result(success, ret);
+        }
+    }
+}
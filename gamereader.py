@@ -0,0 +1,51 @@
+# Bulk reader for the Game contract: reads games(i) and isGameTimeout(i) of thousands of games through a Multicall
+# aggregator, in aggregate3 chunks that stay below the gas limit of eth_call, with all chunks in one JSON-RPC batch.
+#
+# python3 gamereader.py [--from 0] [--to emptyGamePointer] [--multicall address] [--max-gas 20000000]
+# LOCAL=1 reads from the local devnet, deploy game/src/Multicall.sol there first (game/script/Multicall.s.sol) and
+# pass its address with --multicall or MULTICALL_ADDRESS.
+import argparse
+import os
+from collections import namedtuple
+from time import perf_counter
+
+import L1
+import deployment
+from snark import round_sig
+
+# the fields of the GameTracker struct in game/src/Game.sol, in the order games() returns them
+GameTracker = namedtuple('GameTracker', ['boardCommitment1', 'boardCommitment2', 'player1', 'player2', 'hitCounter1', 'hitCounter2',
+    'hitTargets1', 'hitTargets2', 'turn', 'lastMove', 'target', 'gameEnded', 'winner', 'stake', 'withdrawn'])
+
+# upper bound of games(i) plus isGameTimeout(i): 9 cold storage slots (2100 gas each) plus the call overheads
+GAS_PER_GAME = 40000
+
+def read_games(game: L1.Contract, gameIds, multicall: L1.Multicall, maxGas: int = 20_000_000, block = "latest") -> dict[int, tuple[GameTracker, bool]]:
+    # gameId -> (game, timed out)
+    gameIds = list(gameIds)
+    calls = []
+    for gameId in gameIds:
+        calls.append((game.address, game.abi, "games", [gameId]))
+        calls.append((game.address, game.abi, "isGameTimeout", [gameId]))
+    results = multicall.aggregate(calls, maxCalls=max(2, 2 * (maxGas // GAS_PER_GAME)), block=block)
+    return {gameId: (GameTracker(*results[2 * i].result()), results[2 * i + 1].result()) for i, gameId in enumerate(gameIds)}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Read many games of the Game contract at once")
+    parser.add_argument("--from", dest="first", type=int, default=0, help="first game id (default: 0)")
+    parser.add_argument("--to", dest="last", type=int, default=None, help="game id to stop before (default: emptyGamePointer)")
+    parser.add_argument("--multicall", default=os.getenv("MULTICALL_ADDRESS", L1.MULTICALL3_ADDRESS), help="address of the aggregator")
+    parser.add_argument("--max-gas", type=int, default=20_000_000, help="gas budget of one aggregate3 call")
+    args = parser.parse_args()
+
+    game = deployment.connect_game()
+
+    last = args.last if args.last is not None else game._read("emptyGamePointer")
+    startTime = perf_counter()
+    games = read_games(game, range(args.first, last), L1.Multicall(args.multicall), args.max_gas)
+    duration = perf_counter() - startTime
+
+    for gameId, (g, timeout) in games.items():
+        state = "ended" if g.gameEnded else "waiting for player 2" if g.boardCommitment2 == 0 else "timed out" if timeout else "running"
+        print(f"{gameId}: {state}, turn {g.turn}, hits {g.hitCounter1}:{g.hitCounter2}, stake {g.stake}, {g.player1} vs {g.player2}")
+    print(f"Read {len(games)} games in {round_sig(duration)} seconds")
@@ -0,0 +1,85 @@
+# Aggregate the structured gas logs written by L1.py (gaslog.jsonl) per contract function: number of transactions,
+# failures, gas used, effective gas price, block delay and wall-clock latency from sending to the receipt.
+# The logs are streamed, so logs of thousands of games do not have to fit into memory as JSON objects.
+#
+# python3 gasreport.py [--scheme gm17] [--csv] [gas logs, default: gaslog.jsonl]
+import argparse
+import sys
+
+from L1 import GasLog
+from snark import round_sig
+
+def percentile(sortedValues: list, p: float):
+    if not sortedValues:
+        return None
+    return sortedValues[min(len(sortedValues) - 1, int(p / 100 * len(sortedValues)))]
+
+def mean(values: list):
+    return sum(values) / len(values) if values else None
+
+class FunctionStats():
+    def __init__(self):
+        self.count = 0
+        self.failed = 0
+        self.gasUsed = []
+        self.gasPrice = []
+        self.blockDelay = []
+        self.latency = []
+
+    def add(self, e: dict):
+        self.count += 1
+        if e.get('status') != 1:
+            self.failed += 1
+            return
+        self.gasUsed.append(e['gasUsed'])
+        for name, values in (('effectiveGasPrice', self.gasPrice), ('blockDelay', self.blockDelay), ('latency', self.latency)):
+            if e.get(name) is not None:
+                values.append(e[name])
+
+    def row(self) -> list:
+        gas = sorted(self.gasUsed)
+        latency = sorted(self.latency)
+        return [self.count, self.failed,
+                mean(gas), percentile(gas, 50), percentile(gas, 95), gas[-1] if gas else None,
+                None if not self.gasPrice else mean(self.gasPrice) / 10 ** 9,
+                mean(self.blockDelay),
+                mean(latency), percentile(latency, 50), percentile(latency, 95)]
+
+COLUMNS = ['function', 'count', 'failed', 'gas mean', 'gas p50', 'gas p95', 'gas max', 'gwei mean', 'block delay', 'latency mean', 'latency p50', 'latency p95']
+
+def aggregate(files: list[str], scheme: str | None = None) -> dict[str, FunctionStats]:
+    stats = {}
+    for file in files:
+        for e in GasLog.read(file):
+            if scheme is not None and e.get('scheme') != scheme:
+                continue
+            stats.setdefault(e['function'], FunctionStats()).add(e)
+    return stats
+
+def _format(value) -> str:
+    if value is None:
+        return "n/a"
+    if isinstance(value, float):
+        return str(round_sig(value))
+    return str(value)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gas and latency per contract function from the structured gas logs")
+    parser.add_argument("files", nargs="*", default=["gaslog.jsonl"], help="gas logs (default: gaslog.jsonl)")
+    parser.add_argument("--scheme", default=None, help="only transactions with this proof scheme")
+    parser.add_argument("--csv", action="store_true", help="print comma separated values")
+    args = parser.parse_args()
+
+    stats = aggregate(args.files, args.scheme)
+    if not stats:
+        print("No transactions in " + ", ".join(args.files))
+        sys.exit(1)
+
+    rows = [[name, *map(_format, s.row())] for name, s in sorted(stats.items())]
+    if args.csv:
+        for row in [COLUMNS, *rows]:
+            print(",".join(row))
+    else:
+        widths = [max(len(row[i]) for row in [COLUMNS, *rows]) for i in range(len(COLUMNS))]
+        for row in [COLUMNS, *rows]:
+            print("  ".join(cell.ljust(w) if i == 0 else cell.rjust(w) for i, (cell, w) in enumerate(zip(row, widths))))
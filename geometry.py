@@ -0,0 +1,34 @@
+# Board geometry: board dimension, number of ships and ship length.
+# These have to match the constants in board/main.zok, attack/main.zok and game/src/Game.sol. The Python side reads
+# them from the BOARD_DIMENSION, SHIP_COUNT and SHIP_LENGTH environment variables (default 11, 3, 3).
+#
+# A board is a bitmask with one bit per position, committed to as poseidon([board, randomness]) in one field element.
+# Game.sol keeps the turn, the hit counters and the target in uint8 and the attacked positions in one uint256, so
+# boards are limited to 127 positions (a game has up to 2 * positions turns).
+import os
+
+from bitboard import Bitboard
+import bitboard
+from poseidon import poseidon
+
+class Geometry():
+    NO_TARGET: int = 255 # target value that marks "no attack pending" in Game.sol
+
+    def __init__(self, dimension: int = 11, shipCount: int = 3, shipLength: int = 3):
+        self.dimension = dimension
+        self.shipCount = shipCount
+        self.shipLength = shipLength
+        self.positions = dimension * dimension
+        assert 2 * self.positions <= 255 and shipCount * shipLength <= 255, f"Boards of more than 127 positions do not fit into the uint8 counters of Game.sol"
+        if (dimension, shipLength) == (bitboard.DEFAULT.dimension, bitboard.DEFAULT.shipLength):
+            self.bitboard = bitboard.DEFAULT
+        else:
+            self.bitboard = Bitboard(dimension, shipLength)
+
+    def commit(self, board: int, randomness: int) -> int:
+        return poseidon([board, randomness])
+
+    def __repr__(self):
+        return f"<Geometry {self.dimension}x{self.dimension}, {self.shipCount} ships of length {self.shipLength}>"
+
+DEFAULT = Geometry(int(os.getenv("BOARD_DIMENSION", "11")), int(os.getenv("SHIP_COUNT", "3")), int(os.getenv("SHIP_LENGTH", "3")))
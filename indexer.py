@@ -0,0 +1,159 @@
+# Incremental indexer of the Game contract history into SQLite.
+# NewGame, Attack and GameWon logs are fetched in block ranges (several ranges in parallel) and applied in block order,
+# each range in one transaction together with the checkpoint, so an interrupted run resumes where it stopped.
+# Joining a game emits no event, so games without attacks are checked with the Multicall bulk reader (gamereader.py).
+#
+# python3 indexer.py [--db games.sqlite] sync | follow | open <minimum stake in wei> | stats
+import argparse
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter, sleep
+
+from eth_utils import event_abi_to_log_topic
+
+import L1
+import deployment
+import gamereader
+from snark import round_sig
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    gameId INTEGER PRIMARY KEY,
+    player1 TEXT NOT NULL,
+    player2 TEXT, -- NULL for open games anyone can join, until someone joined
+    stake BLOB NOT NULL, -- wei as 32 bytes big endian, so that comparisons work for any amount, see stake_key
+    status TEXT NOT NULL, -- 'open', 'running' or 'ended'
+    turns INTEGER NOT NULL DEFAULT 0,
+    winner INTEGER, -- 1 if player 1 won, 0 if player 2 won
+    createdBlock INTEGER NOT NULL,
+    endedBlock INTEGER
+);
+CREATE INDEX IF NOT EXISTS gamesPlayer1 ON games (player1);
+CREATE INDEX IF NOT EXISTS gamesPlayer2 ON games (player2);
+CREATE INDEX IF NOT EXISTS gamesStake ON games (stake);
+CREATE INDEX IF NOT EXISTS gamesStatus ON games (status, stake);
+
+CREATE TABLE IF NOT EXISTS attacks (
+    block INTEGER NOT NULL,
+    logIndex INTEGER NOT NULL,
+    gameId INTEGER NOT NULL,
+    target INTEGER NOT NULL,
+    PRIMARY KEY (block, logIndex)
+);
+CREATE INDEX IF NOT EXISTS attacksGame ON attacks (gameId);
+
+CREATE TABLE IF NOT EXISTS checkpoint (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    block INTEGER NOT NULL -- every log up to and including this block has been applied
+);
+"""
+
+EVENTS = ["NewGame", "Attack", "GameWon"]
+ZERO_ADDRESS = "0x0000000000000000000000000000000000000000"
+
+def stake_key(wei: int) -> bytes:
+    return wei.to_bytes(32)
+
+class Indexer():
+    def __init__(self, db: str, game: L1.Contract, startBlock: int = 0, step: int = 2000, parallel: int = 4, confirmations: int = 2, multicall: L1.Multicall | None = None):
+        self.db = sqlite3.connect(db)
+        self.db.executescript(SCHEMA)
+        self.game = game
+        self.decoder = L1.get_event_decoder(game.address, game.abi)
+        self.step = step # blocks per eth_getLogs, public nodes limit the range
+        self.parallel = parallel
+        self.confirmations = confirmations # blocks to stay behind the head, so that short reorgs do not reach the index
+        self.multicall = multicall
+        self._topics = [["0x" + event_abi_to_log_topic(e).hex() for e in game.abi if e.get('type') == 'event' and e['name'] in EVENTS]]
+        row = self.db.execute("SELECT block FROM checkpoint").fetchone()
+        self.block = row[0] if row is not None else startBlock - 1
+
+    def _fetch(self, blocks: tuple[int, int]) -> list:
+        first, last = blocks
+        logs = L1.web3.eth.get_logs({"address": self.game.address, "topics": self._topics, "fromBlock": first, "toBlock": last})
+        return self.decoder.decode_logs(logs)
+
+    def _apply(self, event):
+        args = event['args']
+        if event['event'] == 'NewGame':
+            self.db.execute("INSERT OR IGNORE INTO games (gameId, player1, player2, stake, status, createdBlock) VALUES (?, ?, ?, ?, 'open', ?)",
+                (args['gameId'], args['player1'], None if args['player2'] == ZERO_ADDRESS else args['player2'], stake_key(args['stake']), event['blockNumber']))
+        elif event['event'] == 'Attack':
+            inserted = self.db.execute("INSERT OR IGNORE INTO attacks (block, logIndex, gameId, target) VALUES (?, ?, ?, ?)",
+                (event['blockNumber'], event['logIndex'], args['gameId'], args['target'])).rowcount
+            if inserted:
+                self.db.execute("UPDATE games SET turns = turns + 1, status = CASE status WHEN 'open' THEN 'running' ELSE status END WHERE gameId = ?", (args['gameId'],))
+        elif event['event'] == 'GameWon':
+            self.db.execute("UPDATE games SET status = 'ended', winner = ?, endedBlock = ? WHERE gameId = ?", (int(args['winner']), event['blockNumber'], args['gameId']))
+
+    def sync(self, until: int | None = None) -> int:
+        # index up to block `until` (default: the head minus the confirmations), returns the number of events
+        if until is None:
+            until = L1.web3.eth.block_number - self.confirmations
+        ranges = [(first, min(first + self.step - 1, until)) for first in range(self.block + 1, until + 1, self.step)]
+        count = 0
+        with ThreadPoolExecutor(self.parallel) as pool:
+            # map keeps the ranges in order, while up to `parallel` of them are being fetched
+            for (first, last), events in zip(ranges, pool.map(self._fetch, ranges)):
+                with self.db:
+                    for event in events:
+                        self._apply(event)
+                    self.db.execute("INSERT OR REPLACE INTO checkpoint (id, block) VALUES (0, ?)", (last,))
+                self.block = last
+                count += len(events)
+        if self.multicall is not None:
+            self.refresh_open()
+        return count
+
+    def refresh_open(self):
+        # games without attacks may have been joined in the meantime, which emits no event
+        gameIds = [gameId for (gameId,) in self.db.execute("SELECT gameId FROM games WHERE status = 'open'")]
+        games = gamereader.read_games(self.game, gameIds, self.multicall)
+        with self.db:
+            for gameId, (g, _) in games.items():
+                if g.boardCommitment2 != 0 and not g.gameEnded:
+                    self.db.execute("UPDATE games SET status = 'running', player2 = ? WHERE gameId = ?", (g.player2, gameId))
+
+    def follow(self, pollInterval: float = 12):
+        while True:
+            count = self.sync()
+            if count:
+                print(f"Indexed {count} events up to block {self.block}")
+            sleep(pollInterval)
+
+    def open_games(self, minimumStake: int = 0) -> list:
+        return self.db.execute("SELECT gameId, player1, player2, stake FROM games WHERE status = 'open' AND stake >= ? ORDER BY stake DESC", (stake_key(minimumStake),)).fetchall()
+
+    def stats(self) -> dict:
+        ret = {status: count for status, count in self.db.execute("SELECT status, COUNT(*) FROM games GROUP BY status")}
+        ret['averageTurns'] = self.db.execute("SELECT AVG(turns) FROM games WHERE status = 'ended' AND turns > 0").fetchone()[0]
+        ret['players'] = self.db.execute("SELECT COUNT(*) FROM (SELECT player1 FROM games UNION SELECT player2 FROM games WHERE player2 IS NOT NULL)").fetchone()[0]
+        return ret
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index the history of the Game contract into SQLite")
+    parser.add_argument("--db", default="games.sqlite")
+    parser.add_argument("--step", type=int, default=2000, help="blocks per eth_getLogs request")
+    parser.add_argument("--parallel", type=int, default=4, help="block ranges fetched in parallel")
+    parser.add_argument("--multicall", default=os.getenv("MULTICALL_ADDRESS", L1.MULTICALL3_ADDRESS), help="aggregator for checking whether open games were joined, 'none' to skip")
+    parser.add_argument("command", nargs="?", default="sync", choices=["sync", "follow", "open", "stats"])
+    parser.add_argument("minimumStake", nargs="?", type=int, default=0, help="for open: minimum stake in wei")
+    args = parser.parse_args()
+
+    game = deployment.connect_game()
+    multicall = None if args.multicall == 'none' else L1.Multicall(args.multicall)
+    indexer = Indexer(args.db, game, deployment.game_deployment()["block"], args.step, args.parallel, multicall=multicall)
+
+    if args.command == 'sync':
+        startTime = perf_counter()
+        count = indexer.sync()
+        print(f"Indexed {count} events up to block {indexer.block} in {round_sig(perf_counter() - startTime)} seconds")
+    elif args.command == 'follow':
+        indexer.follow()
+    elif args.command == 'open':
+        for gameId, player1, player2, stake in indexer.open_games(args.minimumStake):
+            print(f"{gameId}: stake {int.from_bytes(stake)} by {player1}{'' if player2 is None else f' for {player2}'}")
+    else:
+        for name, value in indexer.stats().items():
+            print(f"{name}: {value}")
@@ -0,0 +1,126 @@
+# Index of all valid board layouts, i.e. sets of ships that neither overlap nor touch.
+# Every layout is stored once as its sorted placement indices (see bitboard.py), one byte each, in a file that
+# is memory-mapped when it is loaded. A bitmap over the rank of every sorted index tuple answers validity lookups.
+#
+# python3 layouts.py [file]   generates the index (default: layouts.bin)
+import mmap
+import os
+import random
+import struct
+import sys
+from math import comb
+from multiprocessing import Pool
+from time import perf_counter
+
+from bitboard import Bitboard
+from geometry import Geometry
+import geometry
+from snark import round_sig
+
+DEFAULT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "layouts.bin")
+
+MAGIC = b'ZKLY'
+VERSION = 1
+# magic, version, dimension, ship length, ship count, bytes per placement index, number of layouts
+HEADER = struct.Struct('<4sBBBBBxxxQ')
+
+def rank(indices) -> int:
+    # position of a sorted index tuple among all sorted tuples of the same length (combinatorial number system)
+    return sum(comb(index, k + 1) for k, index in enumerate(indices))
+
+_bitboard = None
+def _enumerate_from(args) -> tuple[bytes, list[int]]:
+    # all valid sorted layouts whose first placement is `first`, and their ranks
+    dimension, shipLength, shipCount, itemsize, first = args
+    global _bitboard
+    if _bitboard is None or (_bitboard.dimension, _bitboard.shipLength) != (dimension, shipLength):
+        _bitboard = Bitboard(dimension, shipLength)
+    b = _bitboard
+
+    out = bytearray()
+    ranks = []
+    def extend(layout: list[int], board: int):
+        if len(layout) == shipCount:
+            for index in layout:
+                out.extend(index.to_bytes(itemsize, 'little'))
+            ranks.append(rank(layout))
+            return
+        for index in range(layout[-1] + 1, len(b.placements)):
+            if not b.touches(board, index):
+                extend(layout + [index], board | b.shipMasks[index])
+    extend([first], b.shipMasks[first])
+    return bytes(out), ranks
+
+def generate(file: str = DEFAULT_FILE, g: Geometry = geometry.DEFAULT, processes: int | None = None) -> int:
+    b = g.bitboard
+    shipCount = g.shipCount
+    itemsize = 1 if len(b.placements) <= 256 else 2
+    jobs = [(b.dimension, b.shipLength, shipCount, itemsize, first) for first in range(len(b.placements))]
+    with Pool(processes) as pool:
+        # imap keeps the chunks in order of their first placement, so the file ends up sorted
+        chunks = pool.imap(_enumerate_from, jobs)
+
+        bitmap = bytearray((comb(len(b.placements), shipCount) + 7) // 8)
+        count = 0
+        with open(file + '.tmp', 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, b.dimension, b.shipLength, shipCount, itemsize, 0))
+            for chunk, ranks in chunks:
+                f.write(chunk)
+                for r in ranks:
+                    bitmap[r >> 3] |= 1 << (r & 7)
+                count += len(ranks)
+            f.write(bitmap)
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, VERSION, b.dimension, b.shipLength, shipCount, itemsize, count))
+    os.replace(file + '.tmp', file)
+    return count
+
+class LayoutIndex():
+    def __init__(self, file: str = DEFAULT_FILE):
+        with open(file, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, dimension, shipLength, self.shipCount, itemsize, self.count = HEADER.unpack_from(self._mmap)
+        assert magic == MAGIC and version == VERSION, f"{file} is not a layout index"
+        self.bitboard = Geometry(dimension, self.shipCount, shipLength).bitboard
+
+        dataSize = self.count * self.shipCount * itemsize
+        self._layouts = memoryview(self._mmap)[HEADER.size:HEADER.size + dataSize].cast('B' if itemsize == 1 else 'H')
+        self._bitmap = memoryview(self._mmap)[HEADER.size + dataSize:]
+
+    def matches(self, g: Geometry) -> bool:
+        return (self.bitboard.dimension, self.shipCount, self.bitboard.shipLength) == (g.dimension, g.shipCount, g.shipLength)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def layout(self, i: int) -> tuple[int, ...]:
+        # the sorted placement indices of layout i
+        return tuple(self._layouts[i * self.shipCount:(i + 1) * self.shipCount])
+
+    def sample(self, rng = random) -> tuple[int, ...]:
+        return self.layout(rng.randrange(self.count))
+
+    def is_valid(self, indices) -> bool:
+        indices = sorted(indices)
+        if len(indices) != self.shipCount or len(set(indices)) != self.shipCount or indices[0] < 0 or indices[-1] >= len(self.bitboard.placements):
+            return False
+        r = rank(indices)
+        return (self._bitmap[r >> 3] >> (r & 7)) & 1 == 1
+
+    def mask(self, i: int) -> int:
+        # the board of layout i
+        board = 0
+        for index in self.layout(i):
+            board |= self.bitboard.shipMasks[index]
+        return board
+
+    def close(self):
+        self._layouts.release()
+        self._bitmap.release()
+        self._mmap.close()
+
+if __name__ == "__main__":
+    file = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_FILE
+    startTime = perf_counter()
+    count = generate(file)
+    print(f"Wrote {count} layouts to {file} ({os.path.getsize(file)} bytes) in {round_sig(perf_counter() - startTime)} seconds")
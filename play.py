@@ -1,29 +1,17 @@
-from web3 import Web3
 import L1
+import deployment
 import os
 import sys
 import time
 
 from test import *
 
-# use local anvil devnet
-if int(os.getenv('LOCAL', '0')) == 0:
-    L1.web3 = Web3(Web3.HTTPProvider(os.getenv("ETH_RPC_URL", "https://ethereum-sepolia-public.nodies.app")))
-    L1.chain_id = 11155111
-    CONTRACT_ADDRESS = "0x59134804d0Cf3ed908f0f2B6caA55E9D3d9Ac29c"
-else:
-    L1.web3 = Web3(Web3.HTTPProvider("http://127.0.0.1:8545"))
-    L1.chain_id = 31337
-    CONTRACT_ADDRESS = "0xDc64a140Aa3E981100a9becA4E685f962f0cF6C9"
+# use local anvil devnet with LOCAL=1
+game = deployment.connect_game()
 
 private_key = os.getenv("PLAYER_KEY", "0xac0974bec39a17e36ba4a6b4d238ff944bacb478cbed5efcae784d7bf4f2ff80")
 
 PLAYER = L1.OwnedL1Identity(private_key)
-ABI_FILE = "game/out/Game.sol/Game.json"
-
-ABI = L1.load_abi(ABI_FILE)
-
-game = L1.Contract(CONTRACT_ADDRESS, ABI)
 
 if sys.argv[1] == 'new':
     # if you are player one, you can select your opponent and the stake
@@ -31,8 +19,9 @@ if sys.argv[1] == 'new':
     stake = int(sys.argv[3])
 
     board = Board.create_new()
+    board_proof_encoded = SimpleSnark.format_proof(board.prove())[0]
+    # the backup includes the proof once it exists
     print(f"BACKUP YOUR BOARD: {board.export_board()}")
-    board_proof_encoded = SimpleSnark.format_proof(board.proof)[0]
 
     # interact with the smart contract to create a new game
     tx_receipt, logs = game._interact(PLAYER, "newGame", [board.boardCommitment, board_proof_encoded, player2], stake)
@@ -43,12 +32,15 @@ elif sys.argv[1] == 'join':
     # if you are player two, you can specify the game you want to connect to
     gameId = int(sys.argv[2])
 
+    # generate the proof while fetching the game
+    board = Board.create_new()
+    proving = board.prove_async()
+
     res = game._call("games", [gameId])
     stake = res[13]
 
-    board = Board.create_new()
+    board_proof_encoded = SimpleSnark.format_proof(proving.result())[0]
     print(f"BACKUP YOUR BOARD: {board.export_board()}")
-    board_proof_encoded = SimpleSnark.format_proof(board.proof)[0]
 
     # interact with the smart contract to join the game
     game._interact(PLAYER, "joinGame", [gameId, board.boardCommitment, board_proof_encoded], stake)
@@ -57,6 +49,7 @@ elif sys.argv[1] == 'rejoin':
     gameId = int(sys.argv[2])
     boardBackup = sys.argv[3]
 
+    # no proof needed, the board has already been committed to
     board = Board.import_board(boardBackup)
 else:
     print(f"Unsupported option. Either use 'new', 'join' or 'rejoin'")
@@ -65,6 +58,7 @@ else:
 class Game:
     backendContract: L1.Contract
     backendAttackProver: SimpleSnark
+    TIMEOUT_PERIOD = 100 # in blocks, as in Game.sol
 
     def __init__(self, gameId: int, player: L1.OwnedL1Identity, board: Board):
         self.gameId = gameId
@@ -94,17 +88,13 @@ class Game:
 
     def _resolve(self):
         # check whether there is a hit or not at the specified position
-        isHit = (self.board.board & (1 << self.target)) > 0
+        isHit = Board.BITBOARD.is_hit(self.board.board, self.target)
         # calculate the decomposition of the board now
-        boardDecomposition = [(self.board.board >> i) & 1 == 1 for i in range(11 * 11)]
+        boardDecomposition = Board.BITBOARD.decompose(self.board.board)
 
         # sanity checking
-        boardCheck = 0
-        for i in range(11 * 11):
-            if boardDecomposition[i]:
-                boardCheck += 1 << i
-        assert boardCheck == self.board.board
-        assert self.board.boardCommitment == poseidon([boardCheck, self.board.randomness])
+        assert Board.BITBOARD.compose(boardDecomposition) == self.board.board
+        assert self.board.boardCommitment == Board.GEOMETRY.commit(self.board.board, self.board.randomness)
 
         proof = __class__.backendAttackProver.create_proof([self.board.boardCommitment, self.target, isHit, boardDecomposition, self.board.randomness])
         encoded_proof, _ = __class__.backendAttackProver.format_proof(proof)
@@ -123,17 +113,39 @@ class Game:
             return False, None # already ended
         if self.boardCommitment2 == 0:
             return False, None # not yet started
-        if (self.isPlayerOne == (self.turn % 2 == 0)) and (self.target == 255):
+        if (self.isPlayerOne == (self.turn % 2 == 0)) and (self.target == Board.GEOMETRY.NO_TARGET):
             # our turn, and we have to attack
             return True, True
-        if (self.isPlayerOne != (self.turn % 2 == 0)) and (self.target != 255):
+        if (self.isPlayerOne != (self.turn % 2 == 0)) and (self.target != Board.GEOMETRY.NO_TARGET):
             # opponent turn, and we have to resolve
             return True, False
         return False, None
 
+    def needsBlockUpdates(self) -> bool:
+        # joining and resolving do not emit events, so while waiting for them the game is read on every new block
+        if self.boardCommitment2 == 0:
+            return True
+        ourTurn = self.isPlayerOne == (self.turn % 2 == 0)
+        return ourTurn and self.target != Board.GEOMETRY.NO_TARGET
+
+    def watch(self, watcher: L1.EventWatcher):
+        # wait until something happened that changes the game, i.e. an event of this game, a new block while
+        # waiting for the opponent to join or resolve, or the possibility to time out the opponent
+        while True:
+            block, events = watcher.wait()
+            if any(e['args']['gameId'] == self.gameId for e in events) or self.needsBlockUpdates() or block > self.lastMove + __class__.TIMEOUT_PERIOD:
+                self._update()
+                return
+
     def _fetch(self):
-        state = __class__.backendContract._call("games", [self.gameId])
-        [self.boardCommitment1, self.boardCommitment2, self.player1Address, self.player2Address, self.hitCounter1, self.hitCounter2, self.hitTargets1, self.hitTargets2, self.turn, self.lastMove, self.target, self.gameEnded, self.winner, self.stake, self.withdrawn] = state
+        # one JSON-RPC batch for the game and the timeout check
+        c = __class__.backendContract
+        batch = L1.RpcBatch()
+        state = batch.call(c.address, c.abi, "games", [self.gameId])
+        timeout = batch.call(c.address, c.abi, "isGameTimeout", [self.gameId])
+
+        [self.boardCommitment1, self.boardCommitment2, self.player1Address, self.player2Address, self.hitCounter1, self.hitCounter2, self.hitTargets1, self.hitTargets2, self.turn, self.lastMove, self.target, self.gameEnded, self.winner, self.stake, self.withdrawn] = state.result()
+        self.isTimeout = timeout.result()
         self.player1 = L1.L1Identity(self.player1Address)
         self.player2 = L1.L1Identity(self.player2Address)
     
@@ -176,7 +188,7 @@ class Game:
                     self._update()
             else:
                 # check if we can timeout the game
-                if __class__.backendContract._call('isGameTimeout', [self.gameId]):
+                if self.isTimeout:
                     __class__.backendContract._interact(self.player, 'timeoutGame', [self.gameId])
                     print(f"Timeout successful")
                     self._update()
@@ -185,9 +197,9 @@ class Game:
         # print stats about the game
         print(f"Game ended: {self.gameEnded}. Round: {self.turn}.\nPlayer 1: {self.player1Address} Hits: {self.hitCounter1}. \nPlayer 2: {self.player2Address} Hits: {self.hitCounter2}.")
         # draw the game board
-        for y in range(11):
-            for x in range(11):
-                n = y * 11 + x
+        for y in range(Board.BOARD_DIMENSION):
+            for x in range(Board.BOARD_DIMENSION):
+                n = y * Board.BOARD_DIMENSION + x
                 if self.ourHitPositions & (1 << n) > 0:
                     print("X", end='')
                 elif self.ourAttacks & (1 << n) > 0:
@@ -201,13 +213,23 @@ attackSnark = SimpleSnark('attack-reference')
 Game.backendAttackProver = attackSnark
 Game.backendContract = game
 
+# react to Attack and GameWon events and new blocks, WATCH=0 waits for the enter key instead.
+# The filter is installed before the first fetch of the game, so that no event falls between the two
+watcher = L1.EventWatcher(game.address, game.abi, ["Attack", "GameWon"]) if int(os.getenv('WATCH', '1')) else None
+
 gameFramework = Game(gameId, PLAYER, board)
 
 while not gameFramework.gameEnded:
-    while not gameFramework.isOurAction()[0]:
-        print(f"Waiting... Press enter to continue")
-        input()
-        gameFramework._update()
+    while not gameFramework.gameEnded and not gameFramework.isOurAction()[0]:
+        if watcher is None:
+            print(f"Waiting... Press enter to continue")
+            input()
+            gameFramework._update()
+        else:
+            print(f"Waiting for the opponent...")
+            gameFramework.watch(watcher)
+    if gameFramework.gameEnded:
+        break
 
     # perform our move
     gameFramework.print()
@@ -218,10 +240,10 @@ while not gameFramework.gameEnded:
                 sys.exit(-1)
             if ',' in target_str:
                 target_x, target_y = target_str.split(',')
-                target = int(target_y) * 11 + int(target_x)
+                target = int(target_y) * Board.BOARD_DIMENSION + int(target_x)
             else:
                 target = int(target_str)
-            if target < 0 or target >= 11 * 11:
+            if target < 0 or target >= Board.GEOMETRY.positions:
                 print(f"Invalid target! Try again")
             if gameFramework.attackedAlready(target):
                 print(f"You already attacked that position. Try again")
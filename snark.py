@@ -1,8 +1,14 @@
 # This is a simple Zokrates interface
 from subprocess import Popen, PIPE
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import Manager
 import json
+import os
+import shutil
+import tempfile
 from time import perf_counter
 import math
+import struct
 
 def as_zokrates_input(data):
     s = []
@@ -22,12 +28,45 @@ def round_sig(x, sig=3):
         return 0
     return round(x, sig - int(math.floor(math.log10(abs(x)))) - 1)
 
+# read the header section of a compiled out.r1cs file (iden3 binary r1cs format)
+def read_r1cs_header(file: str) -> dict:
+    with open(file, 'rb') as f:
+        data = f.read()
+    assert data[0:4] == b'r1cs', f"{file} is not an r1cs file"
+    _, sections = struct.unpack_from('<II', data, 4)
+    offset = 12
+    for _ in range(sections):
+        sectionType, sectionSize = struct.unpack_from('<IQ', data, offset)
+        offset += 12
+        if sectionType == 1:
+            fieldSize, = struct.unpack_from('<I', data, offset)
+            wires, publicOutputs, publicInputs, privateInputs, labels, constraints = struct.unpack_from('<IIIIQI', data, offset + 4 + fieldSize)
+            return {
+                'wires': wires,
+                'publicOutputs': publicOutputs,
+                'publicInputs': publicInputs,
+                'privateInputs': privateInputs,
+                'labels': labels,
+                'constraints': constraints,
+            }
+        offset += sectionSize
+    raise Exception(f"{file} has no header section")
+
+# the files compute-witness, generate-proof and verify need
+PROVER_ARTIFACTS = ['out', 'out.r1cs', 'abi.json', 'proving.key', 'verification.key']
+
 class SimpleSnark():
     def __init__(self, dir: str):
         self.dir = dir # this is where the SNARK is hiding 
 
-    def create_proof(self, data: list):
-        startTime = perf_counter()
+    # zokrates writes the witness and the proof into the working directory, so concurrent provers need their own
+    def clone(self, dir: str):
+        for name in PROVER_ARTIFACTS:
+            if os.path.exists(os.path.join(self.dir, name)):
+                os.symlink(os.path.abspath(os.path.join(self.dir, name)), os.path.join(dir, name))
+        return __class__(dir)
+
+    def compute_witness(self, data: list) -> bool:
         parsed = as_zokrates_input(data).split(' ')
         p = Popen(["zokrates", "compute-witness", "-a", *parsed], cwd=self.dir, stdout=PIPE, stdin=PIPE, stderr=PIPE)
         p.wait()
@@ -36,10 +75,11 @@ class SimpleSnark():
             raise Exception(f"zokrates returned: {stderr.decode()}")
         if p.returncode != 0 or stdout != b"Computing witness...\nWitness file written to 'witness'\n":
             print(stdout)
-            return None 
-        # witness okay
+            return False
+        return True
 
-        # generate proof now
+    # generate a proof for the witness computed last
+    def generate_proof(self) -> bool:
         p = Popen(["zokrates", "generate-proof", "-s", "gm17"], cwd=self.dir, stdout=PIPE, stdin=PIPE, stderr=PIPE)
         p.wait()
         stdout, stderr = p.communicate()
@@ -47,10 +87,11 @@ class SimpleSnark():
             raise Exception(f"zokrates returned: {stderr.decode()}")
         if p.returncode != 0 or stdout != b"Generating proof...\nProof written to 'proof.json'\n":
             print(stdout)
-            return None
-        stopTime = perf_counter()
-            
-        # read proof.json now
+            return False
+        return True
+
+    # read and serialize the proof.json written by generate_proof
+    def read_proof(self) -> bytes:
         with open(self.dir + '/proof.json', 'r') as f:
             s = f.read()
             obj = json.loads(s)
@@ -70,9 +111,23 @@ class SimpleSnark():
                 i += (int(data, 16)).to_bytes(32)
 
         # the first 256 bytes are proof bytes, the rest is input data
-        print(f"Creating this proof of length {len(p) + len(i)} took {round_sig(stopTime - startTime)} seconds")
-
         return p + i
+
+    def create_proof(self, data: list):
+        startTime = perf_counter()
+        if not self.compute_witness(data):
+            return None
+        # witness okay
+
+        # generate proof now
+        if not self.generate_proof():
+            return None
+        stopTime = perf_counter()
+            
+        proof = self.read_proof()
+        print(f"Creating this proof of length {len(proof)} took {round_sig(stopTime - startTime)} seconds")
+
+        return proof
     
     @staticmethod
     def _bytes_to_hex(o: bytes):
@@ -128,4 +183,39 @@ class SimpleSnark():
         if p.returncode != 0 or stdout != b'Performing verification...\nPASSED\n':
             return False
         else:
-            return True
\ No newline at end of file
+            return True
+
+
+# A process pool where every worker has its own clone of a SimpleSnark, see worker_snark()
+_worker_snark: SimpleSnark = None
+
+def _init_worker(snark: SimpleSnark, dirs):
+    global _worker_snark
+    _worker_snark = snark.clone(dirs.get())
+
+def worker_snark() -> SimpleSnark:
+    return _worker_snark
+
+class SnarkPool():
+    def __init__(self, snark: SimpleSnark, processes: int):
+        self.snark = snark
+        self.processes = processes
+
+    def __enter__(self):
+        self._tmp = tempfile.mkdtemp()
+        self._manager = Manager()
+        dirs = self._manager.Queue()
+        for i in range(self.processes):
+            os.mkdir(os.path.join(self._tmp, str(i)))
+            dirs.put(os.path.join(self._tmp, str(i)))
+        self._pool = ProcessPoolExecutor(self.processes, initializer=_init_worker, initargs=(self.snark, dirs))
+        return self
+
+    # f has to be a module level function, it can use worker_snark() to prove
+    def map(self, f, items) -> list:
+        return list(self._pool.map(f, items))
+
+    def __exit__(self, *args):
+        self._pool.shutdown()
+        self._manager.shutdown()
+        shutil.rmtree(self._tmp)
@@ -0,0 +1,136 @@
+# Storage inspector for the Game contract: reads raw storage in batches, locates the games(i) entries of the `games`
+# mapping and decodes the packed GameTracker fields from the slots, without calling the contract. Snapshots of two
+# blocks can be diffed slot by slot (and field by field for games), e.g. to check what a transaction wrote.
+#
+# python3 storagereader.py dump [--slots 16] [--block latest]
+# python3 storagereader.py games <game ids> [--block latest]
+# python3 storagereader.py diff <block> <other block> [--games <game ids>] [--slots <number of state variables>]
+import argparse
+import json
+import re
+
+from web3 import Web3
+
+import L1
+import deployment
+from gamereader import GameTracker
+
+def mapping_slot(key: int, slot: int) -> int:
+    # location of mapping[key] for a mapping declared at `slot` (value types and uint keys)
+    return int.from_bytes(Web3.keccak(key.to_bytes(32) + slot.to_bytes(32)))
+
+# The state variables of Game.sol in declaration order, for artifacts built without the storage layout. The verifiers
+# are not public, so the ABI cannot tell where they are. test_StorageLayout in game/test checks the order.
+STATE_VARIABLES = ["games", "emptyGamePointer", "boardVerifier", "attackVerifier"]
+
+def state_layout(artifact: dict) -> dict[str, int]:
+    # state variable -> slot, from the storage layout forge writes into the artifact (extra_output in foundry.toml)
+    if 'storageLayout' in artifact:
+        return {v['label']: int(v['slot']) for v in artifact['storageLayout']['storage']}
+    return {name: slot for slot, name in enumerate(STATE_VARIABLES)}
+
+def _type_size(t: str) -> int:
+    if t == 'address':
+        return 20
+    if t == 'bool':
+        return 1
+    if t.startswith('bytes'):
+        return int(t[5:])
+    return int(re.sub(r'^u?int', '', t) or 256) // 8
+
+def struct_layout(abi, getter: str = "games") -> list[tuple[str, str, int, int, int]]:
+    # (field, type, slot within the struct, byte offset within the slot, size) of the struct returned by `getter`.
+    # Solidity packs consecutive fields into one slot while they fit, starting at the lowest-order byte, so the
+    # layout follows from the compiled types.
+    ret = []
+    slot, offset = 0, 0
+    for output in L1.function_entry(abi, getter)['outputs']:
+        size = _type_size(output['type'])
+        if offset + size > 32:
+            slot, offset = slot + 1, 0
+        ret.append((output['name'], output['type'], slot, offset, size))
+        offset += size
+    return ret
+
+def _field(word: bytes, t: str, offset: int, size: int):
+    value = (int.from_bytes(word) >> (8 * offset)) & ((1 << (8 * size)) - 1)
+    if t == 'address':
+        return Web3.to_checksum_address(value.to_bytes(20))
+    if t == 'bool':
+        return value != 0
+    return value
+
+class GameStorage():
+    def __init__(self, game: L1.Contract, artifact: dict = {}):
+        self.game = game
+        self.layout = struct_layout(game.abi)
+        self.slotsPerGame = self.layout[-1][2] + 1
+        self.stateSlots = state_layout(artifact)
+
+    def slots(self, gameId: int) -> list[int]:
+        base = mapping_slot(gameId, self.stateSlots["games"])
+        return [base + i for i in range(self.slotsPerGame)]
+
+    def decode(self, words: list[bytes]) -> GameTracker:
+        return GameTracker(*(_field(words[slot], t, offset, size) for _, t, slot, offset, size in self.layout))
+
+    def from_snapshot(self, storage: dict[int, bytes], gameIds) -> dict[int, GameTracker]:
+        return {gameId: self.decode([storage[slot] for slot in self.slots(gameId)]) for gameId in gameIds}
+
+    def read(self, gameIds, block = "latest") -> dict[int, GameTracker]:
+        gameIds = list(gameIds)
+        return self.from_snapshot(snapshot(self.game.address, [slot for gameId in gameIds for slot in self.slots(gameId)], block), gameIds)
+
+    def labels(self, gameIds) -> dict[int, str]:
+        # slot -> name, for printing diffs
+        ret = {slot: name for name, slot in self.stateSlots.items()}
+        for gameId in gameIds:
+            for i, slot in enumerate(self.slots(gameId)):
+                ret[slot] = f"games[{gameId}]." + ",".join(name for name, _, s, _, _ in self.layout if s == i)
+        return ret
+
+def snapshot(address, slots, block = "latest") -> dict[int, bytes]:
+    return L1.read_storage(address, slots, block)
+
+def diff(before: dict[int, bytes], after: dict[int, bytes]) -> list[tuple[int, bytes, bytes]]:
+    # (slot, old value, new value) of the slots that changed, in slot order
+    return [(slot, before.get(slot, bytes(32)), after.get(slot, bytes(32))) for slot in sorted(before.keys() | after.keys())
+            if before.get(slot, bytes(32)) != after.get(slot, bytes(32))]
+
+def diff_games(before: dict[int, GameTracker], after: dict[int, GameTracker]) -> list[tuple[int, str, object, object]]:
+    # (game id, field, old value, new value) of the fields that changed
+    return [(gameId, field, getattr(before[gameId], field), getattr(after[gameId], field))
+            for gameId in sorted(before.keys() & after.keys()) for field in GameTracker._fields
+            if getattr(before[gameId], field) != getattr(after[gameId], field)]
+
+def _block(value: str):
+    return int(value) if value.isdigit() else value
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Read and decode the raw storage of the Game contract")
+    parser.add_argument("command", choices=["dump", "games", "diff"])
+    parser.add_argument("args", nargs="*", help="games: game ids, diff: two blocks")
+    parser.add_argument("--slots", type=int, default=None, help="number of slots from slot 0 (default: 16 for dump, the state variables for diff)")
+    parser.add_argument("--games", type=int, nargs="*", default=[], help="diff: also diff these games field by field")
+    parser.add_argument("--block", type=_block, default="latest")
+    args = parser.parse_args()
+
+    game = deployment.connect_game()
+    with open(deployment.artifact_file(), 'r') as f:
+        storage = GameStorage(game, json.load(f))
+
+    if args.command == 'dump':
+        game._storagedump(args.slots if args.slots is not None else 16, args.block)
+    elif args.command == 'games':
+        for gameId, g in storage.read(map(int, args.args), args.block).items():
+            print(f"{gameId}: {g}")
+    else:
+        assert len(args.args) == 2, "diff needs two blocks"
+        first, second = map(_block, args.args)
+        slots = [*range(args.slots if args.slots is not None else len(storage.stateSlots)), *(slot for gameId in args.games for slot in storage.slots(gameId))]
+        labels = storage.labels(args.games)
+        before, after = snapshot(game.address, slots, first), snapshot(game.address, slots, second)
+        for slot, old, new in diff(before, after):
+            print(f"{labels.get(slot, slot)}: {old.hex()} -> {new.hex()}")
+        for gameId, field, old, new in diff_games(storage.from_snapshot(before, args.games), storage.from_snapshot(after, args.games)):
+            print(f"games[{gameId}].{field}: {old} -> {new}")
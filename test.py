@@ -1,4 +1,13 @@
-from snark import SimpleSnark
+from snark import SimpleSnark, SnarkPool, worker_snark, round_sig
+from bitboard import Bitboard
+from geometry import Geometry
+import geometry
+from layouts import LayoutIndex
+import layouts
+import backup
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from time import perf_counter
 import random # don't use that in production
 from poseidon import poseidon, fieldsize
 import json
@@ -18,152 +27,228 @@ class ShipPlacement:
         return __class__(*input)
 
 class Board():
-    SHIP_COUNT: int = 3
-    SHIP_LENGTH: int = 3
-    BOARD_DIMENSION: int = 11
+    GEOMETRY: Geometry = geometry.DEFAULT
+    SHIP_COUNT: int = GEOMETRY.shipCount
+    SHIP_LENGTH: int = GEOMETRY.shipLength
+    BOARD_DIMENSION: int = GEOMETRY.dimension
     BOARD_PROVER_BACKEND: SimpleSnark = None
+    BITBOARD: Bitboard = GEOMETRY.bitboard
+    LAYOUT_INDEX: LayoutIndex = None # optional, see layouts.py
+    PROVER_POOL: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=1) # zokrates runs in its own process, a thread is enough to wait for it
+    CREATE_ATTEMPTS: int = 10 # layouts create_new draws before giving up
 
-    def __init__(self, ships: list[ShipPlacement], randomness: int):
+    def __init__(self, ships: list[ShipPlacement], randomness: int, proof: bytes | None = None, boardCommitment: int | None = None):
         self.ships = ships
         self.randomness = randomness
 
         self.board = self.place_ships(ships)
-        self.boardCommitment = poseidon([self.board, randomness])
+        self.boardCommitment = __class__.GEOMETRY.commit(self.board, randomness)
+        # a commitment stored in a backup has to match the board, otherwise the board could not be opened on-chain
+        assert boardCommitment is None or boardCommitment == self.boardCommitment, f"Commitment does not match the board"
 
-        # create a proof now
-        self.proof = __class__.BOARD_PROVER_BACKEND.create_proof([self.boardCommitment, *self.ships, self.randomness])
-        assert self.proof is not None, f"Generating the proof failed"
+        # the proof is only created when it is needed, e.g. importing a backup to rejoin a game does not need one
+        if proof is not None:
+            # the last public input of the proof is the commitment
+            assert proof[-32:] == self.boardCommitment.to_bytes(32), f"Proof is not for this board"
+        self._proof = proof
+        self._proving: Future | None = None
+
+    @property
+    def proof(self) -> bytes:
+        if self._proof is None:
+            self.prove()
+        return self._proof
+
+    def prove(self) -> bytes:
+        return self.prove_async().result()
+
+    def prove_async(self) -> Future:
+        # start generating the proof in the background, e.g. while waiting for the chain
+        if self._proving is None:
+            if self._proof is not None:
+                self._proving = Future()
+                self._proving.set_result(self._proof)
+            else:
+                self._proving = __class__.PROVER_POOL.submit(self._create_proof)
+        return self._proving
+
+    def check_witness(self) -> bool:
+        # the circuit rejects an invalid board when computing the witness, which is much cheaper than proving.
+        # It runs on the prover pool, as zokrates writes the witness into the prover directory
+        return __class__.PROVER_POOL.submit(__class__.BOARD_PROVER_BACKEND.compute_witness, [self.boardCommitment, *self.ships, self.randomness]).result()
+
+    def _create_proof(self) -> bytes:
+        proof = __class__.BOARD_PROVER_BACKEND.create_proof([self.boardCommitment, *self.ships, self.randomness])
+        assert proof is not None, f"Generating the proof failed"
+        self._proof = proof
+        return proof
 
     def print_board(self):
-        s = []
-        for y in range(__class__.BOARD_DIMENSION):
-            for x in range(__class__.BOARD_DIMENSION):
-                if self.board & (1 << (y * __class__.BOARD_DIMENSION + x)) > 0:
-                    s.append('X')
-                else:
-                    s.append('.')
-            s.append('\n')
-        return ''.join(s)
-
-    def place_ships(self, shipPlacements: list[ShipPlacement]) -> int:
-        return sum([self.place_ship(s) for s in shipPlacements])
-
-    def place_ship(self, shipPlacement: ShipPlacement) -> int:
-        # Compute end coordinates based on direction
-        if shipPlacement.directionSelector:  # horizontal
-            endPointX = shipPlacement.startPointX + __class__.SHIP_LENGTH
-            endPointY = shipPlacement.startPointY
-        else:  # vertical
-            endPointX = shipPlacement.startPointX
-            endPointY = shipPlacement.startPointY + __class__.SHIP_LENGTH
-
-        # Assert that ship is within the board
-        assert 0 <= shipPlacement.startPointX < __class__.BOARD_DIMENSION
-        assert 0 <= endPointX < __class__.BOARD_DIMENSION
-        assert 0 <= shipPlacement.startPointY < __class__.BOARD_DIMENSION
-        assert 0 <= endPointY < __class__.BOARD_DIMENSION
+        return __class__.BITBOARD.render(self.board)
+
+    @staticmethod
+    def place_ships(shipPlacements: list[ShipPlacement]) -> int:
+        return sum([__class__.place_ship(s) for s in shipPlacements])
+
+    @staticmethod
+    def place_ship(shipPlacement: ShipPlacement) -> int:
+        # Assert that ship is within the board, i.e. that it is one of the precomputed placements
+        index = __class__.BITBOARD.placement_index(shipPlacement.startPointX, shipPlacement.startPointY, shipPlacement.directionSelector)
+        assert index is not None, "Ship is not within the board"
 
         # Encode ship position as a bitmask
-        partialBoard = 0
-        currentPos = shipPlacement.startPointX + shipPlacement.startPointY * __class__.BOARD_DIMENSION
+        return __class__.BITBOARD.shipMasks[index]
+    
+    def to_bytes(self, includeCommitment: bool = True, includeProof: bool = True) -> bytes:
+        # compact binary backup, see backup.py. The proof is only included if it has already been created
+        indices = [__class__.BITBOARD.placement_index(ship.startPointX, ship.startPointY, ship.directionSelector) for ship in self.ships]
+        assert None not in indices, "Ship is not within the board"
+        return backup.encode(
+            __class__.GEOMETRY,
+            indices,
+            self.randomness,
+            self.boardCommitment if includeCommitment else None,
+            self._proof if includeProof else None,
+        )
 
-        for _ in range(__class__.SHIP_LENGTH):
-            partialBoard += pow(2, currentPos)
+    @staticmethod
+    def from_bytes(data: bytes):
+        indices, randomness, boardCommitment, proof, _ = backup.decode(data, __class__.GEOMETRY)
+        return __class__._from_backup(indices, randomness, boardCommitment, proof)
 
-            if shipPlacement.directionSelector:
-                # move in x direction
-                currentPos += 1
-            else:
-                # move in y direction
-                currentPos += __class__.BOARD_DIMENSION
+    @staticmethod
+    def _from_backup(indices, randomness, boardCommitment, proof):
+        ships = [ShipPlacement(*__class__.BITBOARD.placements[i]) for i in indices]
+        return __class__(ships, randomness, proof, boardCommitment)
 
-        return partialBoard
-    
-    def export_board(self):
-        return json.dumps({'ships': [ship.as_zokrates_input() for ship in self.ships], 'randomness': self.randomness}).encode().hex()
+    def export_board(self, includeProof: bool = True):
+        # the commitment is left out to keep the string short, recomputing it is cheap for a single board
+        return self.to_bytes(includeCommitment=False, includeProof=includeProof).hex()
 
     @staticmethod
     def import_board(backupString: str):
-        d = json.loads(bytes.fromhex(backupString).decode())
+        data = bytes.fromhex(backupString)
+        if backup.is_backup(data):
+            return __class__.from_bytes(data)
+        # hex encoded JSON, as exported by earlier versions
+        d = json.loads(data.decode())
         ships = [ShipPlacement.from_zokrates_input(ship) for ship in d['ships']]
-        return __class__(ships, d['randomness'])
+        proof = bytes.fromhex(d['proof']) if 'proof' in d else None
+        return __class__(ships, d['randomness'], proof)
+
+    @staticmethod
+    def write_backups(file: str, boards: list, includeCommitment: bool = True, includeProof: bool = True):
+        with open(file, 'wb') as f:
+            f.write(b''.join(board.to_bytes(includeCommitment, includeProof) for board in boards))
+
+    @staticmethod
+    def read_backups(file: str) -> list:
+        with open(file, 'rb') as f:
+            return [__class__._from_backup(*record) for record in backup.decode_all(f.read(), __class__.GEOMETRY)]
 
     @staticmethod
     def create_new():
-        while True:
-            try:
-                ships = []
-                for i in range(__class__.SHIP_COUNT):
-                    direction = random.randrange(0, 2) == 0
-                    posX, posY = [random.randrange(0,  __class__.BOARD_DIMENSION - (0 if (i == 1) == direction else __class__.SHIP_LENGTH)) for i in range(2)]
-                    # TODO: check that they don't touch other ships
-                    ships.append(ShipPlacement(posX, posY, direction))
-
-                randomness = random.randrange(0, fieldsize)
-                ret = __class__(ships, randomness)
-                break
-            except AssertionError:
-                pass
-        return ret
+        # sample a valid layout in Python first, so that exactly one proof is generated per board. The circuit has the
+        # last word: a layout it rejects at witness computation is drawn again
+        for _ in range(__class__.CREATE_ATTEMPTS):
+            if __class__.LAYOUT_INDEX is not None:
+                layout = __class__.LAYOUT_INDEX.sample()
+            else:
+                layout = __class__.BITBOARD.sample_layout(__class__.SHIP_COUNT)
+            ships = [ShipPlacement(*__class__.BITBOARD.placements[i]) for i in layout]
+            randomness = random.randrange(0, fieldsize)
+            board = __class__(ships, randomness)
+            if board.check_witness():
+                return board
+        raise Exception(f"The board circuit rejected {__class__.CREATE_ATTEMPTS} layouts that are valid in Python")
 
 board_snark = SimpleSnark("board-reference")
 Board.BOARD_PROVER_BACKEND = board_snark
+if os.path.exists(layouts.DEFAULT_FILE):
+    Board.LAYOUT_INDEX = LayoutIndex(layouts.DEFAULT_FILE)
+    if not Board.LAYOUT_INDEX.matches(Board.GEOMETRY):
+        print(f"Ignoring {layouts.DEFAULT_FILE}, it was generated for a different board geometry")
+        Board.LAYOUT_INDEX = None
 
-if __name__ == "__main__":
+# Circuit tests: every case runs in a worker process with its own prover directory.
+# Cases that should fail only compute the witness, as this is where an invalid board is rejected.
+def _run_board_case(case) -> tuple[bool, str, float]:
+    ships, randomness, shouldPass = case
+    startTime = perf_counter()
+    try:
+        shipPlacements = [ShipPlacement(*ship) for ship in ships]
+        board = Board.place_ships(shipPlacements)
+    except AssertionError:
+        return not shouldPass, "rejected by Python", perf_counter() - startTime
+    data = [Board.GEOMETRY.commit(board, randomness), *shipPlacements, randomness]
+    if not worker_snark().compute_witness(data):
+        return not shouldPass, "rejected at witness", perf_counter() - startTime
+    if not shouldPass:
+        return False, "witness computed", perf_counter() - startTime
+    if not worker_snark().generate_proof():
+        return False, "proof failed", perf_counter() - startTime
+    return True, "proved", perf_counter() - startTime
 
-    def create_board(ship1, ship2, ship3, randomness):
-        return Board([ShipPlacement(*ship1), ShipPlacement(*ship2), ShipPlacement(*ship3)], randomness)
+def run_board_cases(cases: list, processes: int | None = None) -> bool:
+    # cases are (ships, randomness, shouldPass). By default one process per CPU, every process has its own prover
+    # directory and proving memory
+    processes = processes or int(os.getenv("TEST_PROCESSES", min(os.cpu_count() or 1, len(cases))))
+    startTime = perf_counter()
+    with SnarkPool(board_snark, processes) as pool:
+        results = pool.map(_run_board_case, cases)
+
+    ok = True
+    for i, ((ships, randomness, shouldPass), (passed, outcome, duration)) in enumerate(zip(cases, results)):
+        ok = ok and passed
+        print(f"Board #{i} {ships} should {'pass' if shouldPass else 'fail'}: {outcome} in {round_sig(duration)} seconds{'' if passed else ' -- FAILED'}")
+    print(f"Ran {len(cases)} board cases on {processes} processes in {round_sig(perf_counter() - startTime)} seconds (slowest case: {round_sig(max(r[2] for r in results))} seconds)")
+    return ok
+
+if __name__ == "__main__":
 
     def test_boards():
-        # should pass
-        create_board((1,1,1), (3,3,1), (5,5,1), 4533)
-        create_board((2,2,1), (3,6,1), (7,7,0), 4533)
-        create_board((2,2,1), (7,5,1), (7,7,0), 4533)
+        cases = [
+            # should pass
+            (((1,1,1), (3,3,1), (5,5,1)), 4533, True),
+            (((2,2,1), (3,6,1), (7,7,0)), 4533, True),
+            (((2,2,1), (7,5,1), (7,7,0)), 4533, True),
+        ]
 
         # should fail
-        tests_should_raise([
-            lambda: create_board((1,1,1), (1,1,1), (5,5,1), 4533),
-            lambda: create_board((1,1,1), (5,5,1), (5,5,1), 4533),
-            lambda: create_board((1,1,1), (2,2,1), (5,5,1), 4533),
-            lambda: create_board((1,1,1), (4,4,1), (5,5,1), 4533),
-            lambda: create_board((1,1,0), (1,1,0), (5,5,0), 4533),
-            lambda: create_board((1,1,0), (5,5,0), (5,5,0), 4533),
-            lambda: create_board((1,1,0), (2,2,0), (5,5,0), 4533),
-            lambda: create_board((1,1,0), (4,4,0), (5,5,0), 4533),
+        cases += [(ships, 4533, False) for ships in [
+            ((1,1,1), (1,1,1), (5,5,1)),
+            ((1,1,1), (5,5,1), (5,5,1)),
+            ((1,1,1), (2,2,1), (5,5,1)),
+            ((1,1,1), (4,4,1), (5,5,1)),
+            ((1,1,0), (1,1,0), (5,5,0)),
+            ((1,1,0), (5,5,0), (5,5,0)),
+            ((1,1,0), (2,2,0), (5,5,0)),
+            ((1,1,0), (4,4,0), (5,5,0)),
             # ship1 and ship2 intersect
-            lambda: create_board((1,1,1), (0,0,0), (5,5,1), 4533),
-            lambda: create_board((1,1,1), (1,0,0), (5,5,1), 4533),
-            lambda: create_board((1,1,1), (2,0,0), (5,5,1), 4533),
+            ((1,1,1), (0,0,0), (5,5,1)),
+            ((1,1,1), (1,0,0), (5,5,1)),
+            ((1,1,1), (2,0,0), (5,5,1)),
             # ship2 and ship 3 touch or intersect
-            lambda: create_board((2,2,1), (4,6,1), (7,7,0), 4533),
-            lambda: create_board((2,2,1), (5,6,1), (7,7,0), 4533),
-            lambda: create_board((2,2,1), (6,6,1), (7,7,0), 4533),
-            lambda: create_board((2,2,1), (7,6,1), (7,7,0), 4533),
-            lambda: create_board((2,2,1), (8,6,1), (7,7,0), 4533),
-            lambda: create_board((2,2,1), (6,7,1), (7,7,0), 4533),
-            lambda: create_board((2,2,1), (7,7,1), (7,7,0), 4533),
-            lambda: create_board((2,2,1), (8,7,1), (7,7,0), 4533),
-            lambda: create_board((2,2,1), (6,8,1), (7,7,0), 4533),
-            lambda: create_board((2,2,1), (7,8,1), (7,7,0), 4533),
-            lambda: create_board((2,2,1), (8,8,1), (7,7,0), 4533),
-            lambda: create_board((2,2,1), (6,9,1), (7,7,0), 4533),
-            lambda: create_board((2,2,1), (7,9,1), (7,7,0), 4533),
-            lambda: create_board((2,2,1), (8,9,1), (7,7,0), 4533),
-            lambda: create_board((2,2,1), (6,10,1), (7,7,0), 4533),
-            lambda: create_board((2,2,1), (7,10,1), (7,7,0), 4533),
-            lambda: create_board((2,2,1), (8,10,1), (7,7,0), 4533),
-        ])
-
-
-    def tests_should_raise(funcs):
-        for i, func in enumerate(funcs):
-            try:
-                func()
-            except AssertionError as e:
-                print(f"Board #{i} raised an error.")
-                pass  # Expected AssertionError was raised
-            else:
-                raise AssertionError("AssertionError was not raised (e.g. 'Generating the proof failed')")
+            ((2,2,1), (4,6,1), (7,7,0)),
+            ((2,2,1), (5,6,1), (7,7,0)),
+            ((2,2,1), (6,6,1), (7,7,0)),
+            ((2,2,1), (7,6,1), (7,7,0)),
+            ((2,2,1), (8,6,1), (7,7,0)),
+            ((2,2,1), (6,7,1), (7,7,0)),
+            ((2,2,1), (7,7,1), (7,7,0)),
+            ((2,2,1), (8,7,1), (7,7,0)),
+            ((2,2,1), (6,8,1), (7,7,0)),
+            ((2,2,1), (7,8,1), (7,7,0)),
+            ((2,2,1), (8,8,1), (7,7,0)),
+            ((2,2,1), (6,9,1), (7,7,0)),
+            ((2,2,1), (7,9,1), (7,7,0)),
+            ((2,2,1), (8,9,1), (7,7,0)),
+            ((2,2,1), (6,10,1), (7,7,0)),
+            ((2,2,1), (7,10,1), (7,7,0)),
+            ((2,2,1), (8,10,1), (7,7,0)),
+        ]]
+
+        assert run_board_cases(cases), "Some board cases failed"
 
     # sanity check that board exporting works
     board = Board.create_new()
@@ -173,6 +258,22 @@ if __name__ == "__main__":
     assert board.board == imported.board
     assert board.randomness == imported.randomness
 
+    # backups exported by earlier versions (hex encoded JSON) still import
+    legacy = "7b227368697073223a205b5b312c20312c20315d2c205b332c20332c20315d2c205b352c20352c20315d5d2c202272616e646f6d6e657373223a20343533337d"
+    imported = Board.import_board(legacy)
+    assert imported.board == Board.place_ships([ShipPlacement(1, 1, 1), ShipPlacement(3, 3, 1), ShipPlacement(5, 5, 1)])
+    assert imported.randomness == 4533
+    assert imported.boardCommitment == Board.GEOMETRY.commit(imported.board, 4533)
+
+    # binary backups only import under the geometry they were written with, and truncated ones are rejected
+    data = imported.to_bytes()
+    for corrupted, geometry in [(data, Geometry(Board.BOARD_DIMENSION + 1, Board.SHIP_COUNT, Board.SHIP_LENGTH)), (data[:3], Board.GEOMETRY)]:
+        try:
+            backup.decode(corrupted, geometry)
+            assert False, "Invalid backup was imported"
+        except ValueError as e:
+            print(f"Rejected invalid backup: {e}")
+
     board = Board.create_new()
     print(board.print_board())
 